@@ -1,10 +1,11 @@
 import os, sys, json
 from pathlib import Path
 from bson import ObjectId
-from pymongo import MongoClient
 from pymongo.errors import DuplicateKeyError
 
 from src.utils import get_curr_str_time
+from src.index import build_terms_doc
+from src.connection import get_mongo_client
 
 DATABASE_DIR = Path("./database")
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -24,17 +25,25 @@ def create_indexes():
 
     # Create index for score
     score_collections = db["score"]
-    score_collections.create_index([("job_id", 1)])
+    score_collections.create_index([("job_id", 1), ("resume_id", 1)], unique=True)
     score_collections.create_index([("resume_id", 1)])
+    score_collections.create_index(
+        [("job_id", 1), ("initial_score", -1), ("resume_id", 1)]
+    )
 
     # Create index for chat
     chat_collections = db["chat"]
-    chat_collections.create_index([("resume_id", 1)])
+    chat_collections.create_index([("resume_id", 1), ("bucket", -1)], unique=True)
+
+    # Create index for the resume term index
+    terms_collections = db["resume_terms"]
+    terms_collections.create_index([("resume_id", 1)], unique=True)
+    terms_collections.create_index([("updated_at", 1)])
 
 
 if __name__ == "__main__":
     # Connect to MongoDB
-    client = MongoClient("mongodb://localhost:27017/")
+    client = get_mongo_client()
     db = client["CV_RESUME"]
 
     # Clear existing collections
@@ -43,6 +52,7 @@ if __name__ == "__main__":
     db.drop_collection("task")
     db.drop_collection("score")
     db.drop_collection("chat")
+    db.drop_collection("resume_terms")
 
     # Load template jsons
     with open(DATABASE_DIR / "resume.json", encoding="utf-8") as f:
@@ -65,6 +75,9 @@ if __name__ == "__main__":
     resume["created_at"] = get_curr_str_time()
     resume_inserted = resume_collections.insert_one(resume)
 
+    terms_collections = db["resume_terms"]
+    terms_collections.insert_one(build_terms_doc(resume))
+
     job_collections = db["job"]
     job["created_at"] = get_curr_str_time()
     job_inserted = job_collections.insert_one(job)
@@ -1,44 +1,87 @@
-import os, sys, uuid, asyncio, logging
-import httpx, uvicorn
-from rq import Queue
-from redis import Redis
-from redis.asyncio import Redis as AsyncRedis
+import os, time, uuid, asyncio, logging, threading
+
+# Wall-clock reference for the startup report
+IMPORT_STARTED = time.perf_counter()
+
+import uvicorn
+from rq import Queue, Callback
 from fastapi import FastAPI, Request
 from fastapi import BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from contextlib import asynccontextmanager
 from bson.objectid import ObjectId
 
 from src.params import *
-from src.logger import setup_logger, LOGGING_CONFIG
-from src.database import MongoDBDatabase
+from src.logger import setup_logger, set_log_levels, get_log_levels
+from src.database import MongoDBDatabase, AsyncMongoDBDatabase
+from src.connection import get_redis, get_async_redis, pool_stats, close_clients
 from src.worker import start_rq_worker
 from src.scraper import run_scraper
-from src.utils import get_curr_str_time
-
-
-sys.path.append("/home/resume")
+from src.matcher import match_job
+from src.batch import (
+    submit_batch,
+    get_batch_status,
+    cancel_batch,
+    requeue_abandoned_shards,
+)
+from src.index import ResumeIndex
+from src.cache import LRUCache, MatchCache, DocumentCache
+from src.relay import MessageRelay, publish_message
+from src.responder import ResponseService
+from src.dashboard import SECTIONS, load_dashboard, load_page, touch_dashboard
+from src.leaderboard import top_candidates
+from src.progress import stream_progress, open_streams
+from src.scheduler import claim_pending_tasks, enqueue_pending, reserve_filter
+from src.scheduler import release_failed_task, reap_abandoned_tasks
+from src.metrics import flush as flush_metrics, queue_gauges
+from src.metrics import render as render_metrics
+from src.models import get_matcher, prewarm, model_load_times, import_time_report
+from src.utils import get_curr_str_time, get_filter_hash
 
-from match.job_resume_match import ResumeJobMatcher
-from AIChat.AIChat import SendInvitation, GetResponse
 
 ###########################################################
 #                   Initialization                        #
 ###########################################################
 
-# Redis connections
-nsync_redis = Redis(host=REDIS_HOST, port=REDIS_POST, decode_responses=True)
-async_redis = AsyncRedis(host=REDIS_HOST, port=REDIS_POST, decode_responses=True)
+# Redis connections, RQ stores pickled payloads and needs raw responses
+nsync_redis = get_redis()
+async_redis = get_async_redis()
+# Pubsub and blocking reads hold their connection, so they get a pool of their own
+async_subscriber_redis = get_async_redis(subscriber=True)
+rq_redis = get_redis(decode_responses=False)
 
 # RQ Queue
-scraper_queue = Queue(SCRAPER_QUEUE_KEY, connection=nsync_redis)
+scraper_queue = Queue(SCRAPER_QUEUE_KEY, connection=rq_redis)
+matcher_queue = Queue(MATCHER_QUEUE_KEY, connection=rq_redis)
 
 # Logger setup
-setup_logger()
+# Skipped when main is only imported by /debug/startup to profile its imports
+if not os.environ.get(DEBUG_IMPORTTIME_ENV):
+    setup_logger()
 logger = logging.getLogger(__name__)
 
-# Database connection
-mongo_db = MongoDBDatabase()
+# Database connections, the async one serves the request handlers. Both share a
+# cache of point lookups that every process invalidates on writes
+doc_cache = DocumentCache(nsync_redis, async_redis, get_redis(subscriber=True))
+mongo_db = MongoDBDatabase(cache=doc_cache)
+async_mongo_db = AsyncMongoDBDatabase(cache=doc_cache)
+
+# Lexical index used to shortlist resumes for a job
+resume_index = ResumeIndex()
+
+# Cache of evaluate_match results shared by every scoring entry point
+match_cache = MatchCache(nsync_redis)
+
+# Short-lived cache of dashboard pages, dropped when a section's version is bumped
+dashboard_cache = LRUCache(DASHBOARD_CACHE_SIZE, DASHBOARD_CACHE_TTL)
+
+# Chat model dispatcher, created in the lifespan since it owns a thread pool
+response_service: ResponseService = None
+
+# Startup timings, and the import-time breakdown computed on first request
+startup_times = {}
+import_report = None
 
 
 # TODO: Establish a session with the website
@@ -47,13 +90,23 @@ mongo_db = MongoDBDatabase()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage startup and shutdown events."""
+    global response_service
     # Create connection with db
     mongo_db.create_connection()
+    async_mongo_db.create_connection()
+    await asyncio.to_thread(doc_cache.listen)
+    response_service = ResponseService(async_mongo_db)
+    # Models load in the background, the first request waits only if still loading
+    if MODEL_PREWARM:
+        asyncio.create_task(asyncio.to_thread(prewarm))
     # Create background tasks
     # asyncio.create_task(start_rq_worker())
     asyncio.create_task(scraper_scheduler())
+    asyncio.create_task(scraper_slot_reaper())
+    asyncio.create_task(matcher_shard_reaper())
     # asyncio.create_task(message_monitor())
     # asyncio.create_task(process_message())
+    startup_times["ready_s"] = round(time.perf_counter() - IMPORT_STARTED, 4)
 
     yield
 
@@ -63,9 +116,16 @@ async def lifespan(app: FastAPI):
         task.cancel()
     # Close connection with db
     mongo_db.close_connection()
+    async_mongo_db.close_connection()
+    doc_cache.close()
+    response_service.close()
+    await async_redis.aclose()
+    await async_subscriber_redis.aclose()
+    close_clients()
 
 
 app = FastAPI(lifespan=lifespan)
+startup_times["import_s"] = round(time.perf_counter() - IMPORT_STARTED, 4)
 templates = Jinja2Templates(directory="templates")
 
 
@@ -80,59 +140,112 @@ async def serve_chat(request: Request):
 
 
 @app.get("/main")
-async def serve_main(request: Request):
-    resume_list = mongo_db.select_data("resume")
-    job_list = mongo_db.select_data("job")
-    task_list = mongo_db.select_data("task")
+async def serve_main(
+    request: Request,
+    resume_cursor: str = None,
+    limit: int = DASHBOARD_PAGE_SIZE,
+):
+    cursors = {TABLE.RESUME.value: resume_cursor}
+    try:
+        pages = await load_dashboard(
+            async_mongo_db, async_redis, dashboard_cache, cursors, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return templates.TemplateResponse(
         "/main.html",
         {
             "request": request,
-            "resumes": resume_list,
-            "jobs": job_list,
-            "tasks": task_list,
+            "resumes": pages[TABLE.RESUME.value]["items"],
+            "pages": pages,
+            "limit": limit,
         },
     )
 
 
+@app.get("/main/{section}")
+async def dashboard_section(
+    section: str, cursor: str = None, limit: int = DASHBOARD_PAGE_SIZE
+):
+    """Return one page of a dashboard section, for incremental loading."""
+    if section not in SECTIONS:
+        raise HTTPException(status_code=404, detail="Section not found")
+    version = await async_redis.hget(DASHBOARD_VERSION_KEY, section)
+    try:
+        return await load_page(
+            async_mongo_db, dashboard_cache, section, cursor, limit, version or "0"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 ###########################################################
 #                       Scraper                           #
 ###########################################################
 
 
 async def scraper_scheduler():
-    """Continuously schedule pending scraper tasks if slots are available."""
+    """Dispatch pending scraper tasks as soon as work or a free slot appears."""
     logger.info("Scraper scheduler started...")
 
-    while True:
-        running = int(nsync_redis.get(SCRAPER_RUNNING_TASKS_KEY) or 0)
-        if running < MAX_RUNNING_TASKS:
-            task_id = nsync_redis.lpop(SCRAPER_PENDING_TASKS_KEY)
-            if task_id:
-                nsync_redis.incr(SCRAPER_RUNNING_TASKS_KEY)
-                scraper_queue.enqueue(run_scraper, task_id)
+    pubsub = async_subscriber_redis.pubsub()
+    await pubsub.subscribe(SCRAPER_EVENTS_CHANNEL)
+    try:
+        while True:
+            for task_id in await claim_pending_tasks(async_redis):
+                await asyncio.to_thread(
+                    scraper_queue.enqueue,
+                    run_scraper,
+                    task_id,
+                    on_failure=Callback(release_failed_task),
+                )
                 logger.info(f"Scheduled pending task {task_id}")
 
-        await asyncio.sleep(10)
-        if asyncio.current_task().cancelled():
-            break
+            # Sleep until a task is submitted or a running one releases its slot
+            await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=SCRAPER_SCHEDULER_TIMEOUT
+            )
+    finally:
+        await pubsub.aclose()
+
+
+async def scraper_slot_reaper():
+    """Periodically release the slots of tasks whose scraper worker died."""
+    logger.info("Scraper slot reaper started...")
+    while True:
+        await asyncio.to_thread(reap_abandoned_tasks, scraper_queue)
+        await asyncio.sleep(SCRAPER_REAP_INTERVAL)
 
 
 @app.post("/scraper")
 async def scraper(request: Request):
-    """Submit a new scraper task."""
+    """Submit a new scraper task, or attach to an identical one."""
     param_dict = await request.json()
 
-    # Generate job_id, push the task into redis
+    # Generate job_id, mark it pending before it can be attached to
     task_id = str(uuid.uuid4())
-    nsync_redis.set(task_id, "Pending")
-    nsync_redis.rpush(SCRAPER_PENDING_TASKS_KEY, task_id)
-
-    # Insert task record into database
+    await async_redis.set(task_id, "Pending")
+
+    # Identical filters share one crawl while it is in flight or recently finished
+    filter_hash = get_filter_hash(param_dict)
+    holder_id = await reserve_filter(async_redis, filter_hash, task_id)
+    if holder_id != task_id:
+        await async_redis.delete(task_id)
+        logger.info(f"Task with filter {filter_hash} attached to task {holder_id}")
+        return {
+            "message": "An identical task is already queued or recently finished.",
+            "task_id": holder_id,
+        }
+
+    # Insert task record into database before it becomes claimable
     param_dict["task_id"] = task_id
     param_dict["status"] = "Pending"
+    param_dict["filter_hash"] = filter_hash
     param_dict["created_at"] = get_curr_str_time()
-    mongo_db.insert_data(TABLE.TASK.value, param_dict)
+    await async_mongo_db.insert_data(TABLE.TASK.value, param_dict)
+    await asyncio.to_thread(touch_dashboard, nsync_redis, TABLE.TASK.value)
+
+    await enqueue_pending(async_redis, task_id)
 
     logger.info(f"Task {task_id} enqueued successfully!")
 
@@ -145,12 +258,36 @@ async def scraper(request: Request):
 @app.get("/scraper/status/{task_id}")
 async def scraper_status(task_id: str):
     """Get the status of a scraper task."""
-    status = nsync_redis.get(task_id)
+    status = await async_redis.get(task_id)
     if status is None:
         return {"status": "None", "message": "Task not found."}
     return {"status": status, "task_id": task_id}
 
 
+def progress_response(task_ids: list) -> StreamingResponse:
+    if open_streams() >= SCRAPER_STREAM_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many open progress streams")
+    return StreamingResponse(
+        stream_progress(async_redis, task_ids, async_subscriber_redis),
+        media_type="text/event-stream",
+    )
+
+
+@app.get("/scraper/stream/{task_id}")
+async def scraper_stream(task_id: str):
+    """Push the state transitions and counters of a scraper task as Server-Sent Events."""
+    return progress_response([task_id])
+
+
+@app.get("/scraper/stream")
+async def scraper_stream_many(task_ids: str):
+    """Push the progress of several comma separated scraper tasks on one connection."""
+    task_ids = list(dict.fromkeys(t for t in task_ids.split(",") if t))
+    if not task_ids:
+        raise HTTPException(status_code=400, detail="No task_ids given")
+    return progress_response(task_ids)
+
+
 ###########################################################
 #                     Message Relay                       #
 ###########################################################
@@ -188,7 +325,7 @@ async def message_monitor():
     async for user_id, message in detect_new_message():
         logger.info(f"New message detected from user {user_id}: {message}")
 
-        await async_redis.rpush(MESSAGE_QUEUE_KEY, f"{user_id}|||{message}")
+        await publish_message(async_redis, user_id, message)
         logger.info(f"Message pushed to Redis for user {user_id}: {message}")
 
         if asyncio.current_task().cancelled():
@@ -198,68 +335,54 @@ async def message_monitor():
 # TODO: This is a mock function of sending invitation to candidates
 @app.post("/invitation")
 async def invitation(payload: dict):
-    resume_id = payload["resume_id"]
-    job_id = ObjectId(payload["job_id"])
-    resume = mongo_db.select_data("resume", {"resume_id": resume_id})[0]
-    job = mongo_db.select_data("job", {"_id": job_id})[0]
-
-    response = SendInvitation(resume, job)
+    response = await response_service.invite(payload["resume_id"], payload["job_id"])
     return {"response": response}
 
 
 # TODO: This is a mock function of generating response for given message
 @app.post("/llm")
 async def llm(payload: dict):
-    message = payload["message"]
-    resume_id = payload["resume_id"]
-    job_id = ObjectId(payload["job_id"])
-    chat = mongo_db.select_data("chat", {"resume_id": resume_id})[0]
-    job = mongo_db.select_data("job", {"_id": job_id})[0]
-
-    response = GetResponse(message, chat, job)
+    response = await response_service.respond(
+        payload["message"], payload["resume_id"], payload["job_id"]
+    )
     return {"response": response}
 
 
-async def generate_response(message: str) -> str:
-    """Simulate generating a response based on the user's message."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"http://{APP_HOST}:{APP_PORT}/llm", json={"message": message}
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return data["response"]
-
-
 # TODO: This is a mock function of sending response to the given user
 async def send_response(user_id: str, response: str):
     """Send the generated response to the user (mock function)."""
     raise NotImplementedError()
-    logger.info(f"[SEND] Responding to user {user_id}: {response}")
+    logger.info(
+        f"[SEND] Responding to user {user_id}: {response}", extra={"sample": True}
+    )
     return True
 
 
-async def process_message():
-    """Background worker that listens for new messages and processes them."""
+async def handle_message(fields: dict):
+    """Generate, send and save the response to one relayed message."""
     # TODO: Handle the storage of message and reponse here!
-    logger.info("Message worker started...")
-    while True:
-        data = await async_redis.blpop(MESSAGE_QUEUE_KEY, timeout=0)
-        if data:
-            _, value = data
-            user_id, message = value.split("|||", 1)
-            logger.info(f"Processing message from user {user_id}: {message}")
+    user_id, message = fields["user_id"], fields["message"]
+    logger.info(
+        f"Processing message from user {user_id}: {message}", extra={"sample": True}
+    )
 
-            response = await generate_response(message)
+    # Messages from the stream carry the candidate's resume and job when known
+    response = await response_service.respond(
+        message, fields.get("resume_id", user_id), fields.get("job_id")
+    )
 
-            await send_response(user_id, response)
+    await send_response(user_id, response)
 
-            await async_redis.rpush(f"user:{user_id}:responses", response)
-            logger.info(f"Response generated and saved for user {user_id}: {response}")
+    await async_redis.rpush(f"user:{user_id}:responses", response)
+    logger.info(
+        f"Response generated and saved for user {user_id}: {response}",
+        extra={"sample": True},
+    )
 
-        await asyncio.sleep(1)
-        if asyncio.current_task().cancelled():
-            break
+
+async def process_message():
+    """Background worker that consumes the message stream as part of the relay group."""
+    await MessageRelay(async_redis, handle_message, reader=async_subscriber_redis).run()
 
 
 ###########################################################
@@ -267,43 +390,191 @@ async def process_message():
 ###########################################################
 
 
+# Cancellation flags of the matcher runs in progress, keyed by job_id
+matcher_cancellations = {}
+
+
+async def matcher_shard_reaper():
+    """Periodically re-queue the batch shards left behind by dead workers."""
+    logger.info("Matcher shard reaper started...")
+    while True:
+        await asyncio.to_thread(requeue_abandoned_shards, matcher_queue)
+        await asyncio.sleep(MATCHER_REAP_INTERVAL)
+
+
+@app.post("/matcher/batch")
+async def matcher_batch(payload: dict):
+    """Match many jobs against the resume pool, sharded across the RQ matcher workers."""
+    job_ids = payload.get("job_ids") or []
+    if not job_ids or not all(ObjectId.is_valid(job_id) for job_id in job_ids):
+        raise HTTPException(status_code=400, detail="Invalid job_ids")
+
+    batch = await asyncio.to_thread(submit_batch, matcher_queue, mongo_db, job_ids)
+    return {"status": "accepted", **batch}
+
+
+@app.get("/matcher/batch/{batch_id}")
+async def matcher_batch_status(batch_id: str):
+    """Report the aggregated progress of a batch."""
+    status = await asyncio.to_thread(
+        get_batch_status, nsync_redis, matcher_queue, batch_id
+    )
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
+
+@app.delete("/matcher/batch/{batch_id}")
+async def cancel_matcher_batch(batch_id: str):
+    """Cancel every remaining shard of a batch."""
+    if not await asyncio.to_thread(cancel_batch, nsync_redis, batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {"status": "cancelling", "batch_id": batch_id}
+
+
 @app.post("/matcher/{job_id}")
-async def matcher(job_id: str, background_tasks: BackgroundTasks):
+async def matcher(job_id: str, background_tasks: BackgroundTasks, top_k: int = None):
     try:
         job_oid = ObjectId(job_id)
     except Exception:
         logger.error("Get invalid job_id")
         raise HTTPException(status_code=400, detail="Invalid job_id")
 
-    background_tasks.add_task(run_matcher_task, job_oid)
+    background_tasks.add_task(run_matcher_task, job_oid, top_k)
     return {"status": "accepted", "detail": "Matcher started in background"}
 
 
-def run_matcher_task(job_id: ObjectId):
+@app.get("/matcher/{job_id}/shortlist")
+async def shortlist(job_id: str, top_k: int = 50):
+    """Return the resumes most relevant to a job according to the lexical index."""
+    try:
+        job_oid = ObjectId(job_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+
+    job = await async_mongo_db.select_data("job", {"_id": job_oid})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    ranked = await asyncio.to_thread(resume_index.shortlist, mongo_db, job[0], top_k)
+    return {
+        "job_id": job_id,
+        "resumes": [{"resume_id": r, "relevance": round(s, 4)} for r, s in ranked],
+    }
+
+
+@app.get("/matcher/{job_id}/candidates")
+async def candidates(
+    job_id: str,
+    limit: int = 50,
+    min_score: float = None,
+    cursor: str = None,
+    with_resume: bool = False,
+):
+    """Return a page of the job's candidates ranked by initial score."""
+    try:
+        job_oid = ObjectId(job_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+
+    try:
+        return await asyncio.to_thread(
+            top_candidates, mongo_db, job_oid, limit, min_score, cursor, with_resume
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/matcher/cache/stats")
+async def matcher_cache_stats():
+    """Report the hit and miss counters of the evaluate_match cache."""
+    return match_cache.stats()
+
+
+@app.get("/database/cache/stats")
+async def document_cache_stats():
+    """Report the per-collection hit and miss counters of the document cache."""
+    return doc_cache.stats()
+
+
+@app.get("/debug/startup")
+async def startup_report(refresh: bool = False):
+    """Report startup timings, model load times and an `-X importtime` breakdown of main."""
+    global import_report
+    if import_report is None or refresh:
+        import_report = await asyncio.to_thread(import_time_report)
+    return {
+        **startup_times,
+        "models": model_load_times(),
+        "import_time": import_report,
+    }
+
+
+@app.get("/debug/logging")
+async def log_levels():
+    """Report the effective level of the root, uvicorn and src loggers."""
+    return get_log_levels()
+
+
+@app.put("/debug/logging")
+async def update_log_levels(payload: dict):
+    """Change logger levels of this process at runtime, e.g. {"src.database": "DEBUG"}."""
+    try:
+        return set_log_levels(payload)
+    except (TypeError, ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/metrics")
+async def metrics():
+    """Expose the metrics of every process in the Prometheus text format."""
+
+    def collect():
+        flush_metrics(nsync_redis)
+        gauges = queue_gauges(nsync_redis, [scraper_queue, matcher_queue])
+        return render_metrics(nsync_redis, gauges)
+
+    return PlainTextResponse(
+        await asyncio.to_thread(collect), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/database/pools/stats")
+async def connection_pool_stats():
+    """Report checkouts, waits and saturation of this process's connection pools."""
+    return pool_stats()
+
+
+@app.delete("/matcher/{job_id}")
+async def cancel_matcher(job_id: str):
+    """Cancel the matcher run in progress for a job."""
+    cancel = matcher_cancellations.get(job_id)
+    if cancel is None:
+        raise HTTPException(status_code=404, detail="No matcher running for job_id")
+    cancel.set()
+    return {"status": "cancelling", "job_id": job_id}
+
+
+def run_matcher_task(job_id: ObjectId, top_k: int = None):
     job = mongo_db.select_data("job", {"_id": job_id})
     if not job:
         logger.error(f"Can't find corresponding job for job_id {job_id}")
         return
     job = job[0]
-    resume_list = mongo_db.select_data("resume")
 
-    resume_job_matcher = ResumeJobMatcher()
+    # In top-K mode only the lexically most relevant resumes are considered
+    query = {}
+    if top_k:
+        ranked = resume_index.shortlist(mongo_db, job, top_k)
+        query = {"resume_id": {"$in": [resume_id for resume_id, _ in ranked]}}
+    resumes = mongo_db.iter_data("resume", query)
 
-    for resume in resume_list:
-        logger.info(
-            f"Start matching for job_id {job_id} and resume_id {resume['resume_id']}..."
-        )
-        score = resume_job_matcher.evaluate_match(resume, job)
-        score["job_id"] = job_id
-        score["answers"] = []
-        score["final_score"] = -1
-        score["status"] = "evaluated"
-        score["updated_at"] = get_curr_str_time()
-        mongo_db.insert_data("score", score)
-        logger.info(
-            f"Finish match for job_id {job_id} and resume_id {resume['resume_id']}, initial score is {score['initial_score']:>4.1f}."
-        )
+    cancel = matcher_cancellations.setdefault(str(job_id), threading.Event())
+    try:
+        match_job(mongo_db, job, resumes, get_matcher(), cancel, match_cache)
+    finally:
+        matcher_cancellations.pop(str(job_id), None)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=APP_HOST, port=APP_PORT, log_config=LOGGING_CONFIG)
+    # Logging is already configured, uvicorn would replace the queue handlers
+    uvicorn.run(app, host=APP_HOST, port=APP_PORT, log_config=None)
@@ -0,0 +1,6 @@
+#!/bin/bash
+curl -X POST \
+  "http://127.0.0.1:8000/matcher/batch" \
+  -H "accept: application/json" \
+  -H "Content-Type: application/json" \
+  -d '{"job_ids": ["6827ed530cb2e84f544d14f6"]}'
@@ -0,0 +1,2 @@
+#!/bin/bash
+python -m src.pool matcher > "logs/rq/matcher.log" 2>&1
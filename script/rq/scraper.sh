@@ -1,2 +1,2 @@
 #!/bin/bash
-rq worker scraper_queue > "logs/rq/scraper.log" 
\ No newline at end of file
+python -m src.pool > "logs/rq/scraper.log" 2>&1
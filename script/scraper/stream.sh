@@ -0,0 +1,4 @@
+#!/bin/bash
+curl -N -X 'GET' \
+  'http://127.0.0.1:8000/scraper/stream/356bcd06-a7e2-4b6c-91fa-79f4091c043c' \
+  -H 'accept: text/event-stream'
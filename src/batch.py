@@ -0,0 +1,169 @@
+import json
+import uuid
+import logging
+import threading
+from bson import ObjectId
+from redis import Redis
+from rq import Queue, Retry
+from rq.job import Job
+from rq.registry import StartedJobRegistry
+from .params import (
+    TABLE,
+    MATCHER_BATCH_KEY,
+    MATCHER_BATCH_TTL,
+    MATCHER_SHARD_SIZE,
+    MATCHER_SHARD_RETRIES,
+    MATCHER_SHARD_TIMEOUT,
+    MATCHER_CANCEL_POLL,
+)
+from .utils import get_curr_str_time
+from .database import MongoDBDatabase
+from .connection import get_redis
+from .cache import MatchCache
+from .matcher import match_job
+from .models import get_matcher
+from .metrics import flush_quietly
+
+logger = logging.getLogger(__name__)
+
+
+def _batch_key(batch_id: str) -> str:
+    return f"{MATCHER_BATCH_KEY}:{batch_id}"
+
+
+def plan_shards(
+    mongo_db: MongoDBDatabase, shard_size: int = MATCHER_SHARD_SIZE
+) -> list:
+    """Split the resume pool into [lower, upper) ranges of `_id` holding `shard_size` resumes."""
+    ids = mongo_db.iter_data(TABLE.RESUME.value, {}, {"_id": 1})
+    bounds = [doc["_id"] for n, doc in enumerate(ids) if n % shard_size == 0]
+    return [(lower, upper) for lower, upper in zip(bounds, bounds[1:] + [None])]
+
+
+def submit_batch(queue: Queue, mongo_db: MongoDBDatabase, job_ids: list) -> dict:
+    """Fan the (job, resume shard) pairs of a batch out to the matcher queue."""
+    batch_id = str(uuid.uuid4())
+    shards = plan_shards(mongo_db)
+    jobs = [
+        Queue.prepare_data(
+            run_matcher_shard,
+            (batch_id, job_id, lower, upper),
+            job_id=f"{batch_id}_{job_id}_{n}",
+            timeout=MATCHER_SHARD_TIMEOUT,
+            result_ttl=MATCHER_BATCH_TTL,
+            failure_ttl=MATCHER_BATCH_TTL,
+            retry=Retry(max=MATCHER_SHARD_RETRIES),
+        )
+        for job_id in job_ids
+        for n, (lower, upper) in enumerate(shards)
+    ]
+
+    # The batch hash goes first in the same transaction, so a fast shard can never
+    # increment its counters before they are initialised
+    key = _batch_key(batch_id)
+    pipe = queue.connection.pipeline()
+    pipe.hset(
+        key,
+        mapping={
+            "job_ids": json.dumps(job_ids),
+            "shards": len(jobs),
+            "scored": 0,
+            "failed": 0,
+            "created_at": get_curr_str_time(),
+        },
+    )
+    if jobs:
+        pipe.rpush(f"{key}:shards", *[job.job_id for job in jobs])
+    pipe.expire(key, MATCHER_BATCH_TTL)
+    pipe.expire(f"{key}:shards", MATCHER_BATCH_TTL)
+    queue.enqueue_many(jobs, pipeline=pipe)
+    pipe.execute()
+    logger.info(
+        f"Batch {batch_id} submitted: {len(job_ids)} jobs x {len(shards)} shards."
+    )
+    return {"batch_id": batch_id, "shards": len(jobs)}
+
+
+def get_batch_status(redis: Redis, queue: Queue, batch_id: str) -> dict:
+    """Aggregate the progress of a batch from its shards, None if it is unknown."""
+    key = _batch_key(batch_id)
+    info = redis.hgetall(key)
+    if not info:
+        return None
+
+    shard_ids = redis.lrange(f"{key}:shards", 0, -1)
+    states = {}
+    for job in Job.fetch_many(shard_ids, connection=queue.connection):
+        state = job.get_status(refresh=False).value if job else "expired"
+        states[state] = states.get(state, 0) + 1
+    return {
+        "batch_id": batch_id,
+        "job_ids": json.loads(info["job_ids"]),
+        "shards": int(info["shards"]),
+        "shard_states": states,
+        "scored": int(info["scored"]),
+        "failed": int(info["failed"]),
+        "cancelled": bool(info.get("cancelled")),
+        "created_at": info["created_at"],
+    }
+
+
+def cancel_batch(redis: Redis, batch_id: str) -> bool:
+    """Flag a batch as cancelled, running shards stop at their next poll."""
+    key = _batch_key(batch_id)
+    if not redis.exists(key):
+        return False
+    redis.hset(key, "cancelled", 1)
+    return True
+
+
+def requeue_abandoned_shards(queue: Queue):
+    """Hand the shards of dead workers back to the queue, or fail them once out of retries."""
+    StartedJobRegistry(queue=queue).cleanup()
+
+
+def _watch_cancel(
+    redis: Redis, key: str, cancel: threading.Event, done: threading.Event
+):
+    while not done.wait(MATCHER_CANCEL_POLL):
+        if redis.hget(key, "cancelled"):
+            cancel.set()
+            return
+
+
+def run_matcher_shard(batch_id: str, job_id: str, lower: ObjectId, upper: ObjectId):
+    """Score one job against the resumes whose `_id` lies in [lower, upper)."""
+    redis = get_redis()
+    key = _batch_key(batch_id)
+    if redis.hget(key, "cancelled"):
+        logger.info(f"Batch {batch_id} cancelled, skipping shard of job_id {job_id}")
+        return None
+
+    mongo_db = MongoDBDatabase()
+    mongo_db.create_connection()
+    cancel, done = threading.Event(), threading.Event()
+    watcher = threading.Thread(
+        target=_watch_cancel, args=(redis, key, cancel, done), daemon=True
+    )
+    watcher.start()
+    try:
+        job = mongo_db.select_data(TABLE.JOB.value, {"_id": ObjectId(job_id)})
+        if not job:
+            logger.error(f"Can't find corresponding job for job_id {job_id}")
+            return None
+
+        id_range = {"$gte": lower} if upper is None else {"$gte": lower, "$lt": upper}
+        resumes = mongo_db.iter_data(TABLE.RESUME.value, {"_id": id_range})
+        stats = match_job(
+            mongo_db, job[0], resumes, get_matcher(), cancel, MatchCache(redis)
+        )
+
+        pipe = redis.pipeline()
+        pipe.hincrby(key, "scored", stats["scored"])
+        pipe.hincrby(key, "failed", stats["failed"])
+        pipe.execute()
+        return stats
+    finally:
+        done.set()
+        mongo_db.close_connection()
+        flush_quietly(redis)
@@ -0,0 +1,299 @@
+import os
+import copy
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from .params import (
+    MATCH_CACHE_KEY,
+    MATCH_CACHE_SIZE,
+    MATCH_CACHE_TTL,
+    MATCH_CACHE_REDIS_MAX_ENTRIES,
+    DOC_CACHE_KEYS,
+    DOC_CACHE_SIZE,
+    DOC_CACHE_TTL,
+    DOC_CACHE_CHANNEL,
+)
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with an optional TTL and hit/miss counters."""
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and (
+                entry[1] is None or entry[1] > time.monotonic()
+            ):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = ttl or self.ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+class MatchCache:
+    """
+    Two-tier cache of evaluate_match results keyed by the content of the resume, the job
+    and the matcher version. The Redis tier is shared by every process and trimmed to
+    MATCH_CACHE_REDIS_MAX_ENTRIES, evicting the least recently written entries first.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        maxsize: int = MATCH_CACHE_SIZE,
+        ttl: int = MATCH_CACHE_TTL,
+        max_entries: int = MATCH_CACHE_REDIS_MAX_ENTRIES,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local = LRUCache(maxsize, ttl)
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    def get(self, key: str):
+        score = self.local.get(key)
+        if score is not None:
+            return score
+        try:
+            payload = self.redis.get(f"{MATCH_CACHE_KEY}:{key}")
+        except Exception as e:
+            logger.error(f"Failed to read match cache: {e}")
+            return None
+        if payload is None:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        score = json.loads(payload)
+        self.local.set(key, score)
+        return score
+
+    def set(self, key: str, score: dict):
+        self.local.set(key, score)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(
+                f"{MATCH_CACHE_KEY}:{key}",
+                json.dumps(score, ensure_ascii=False, default=str),
+                ex=self.ttl,
+            )
+            pipe.zadd(MATCH_CACHE_KEY, {key: time.time()})
+            pipe.zcard(MATCH_CACHE_KEY)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                evicted = self.redis.zpopmin(MATCH_CACHE_KEY, size - self.max_entries)
+                self.redis.delete(*[f"{MATCH_CACHE_KEY}:{k}" for k, _ in evicted])
+        except Exception as e:
+            logger.error(f"Failed to write match cache: {e}")
+
+    def stats(self) -> dict:
+        total = self.redis_hits + self.redis_misses
+        return {
+            "local": self.local.stats(),
+            "redis": {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "hit_ratio": round(self.redis_hits / total, 4) if total else None,
+            },
+        }
+
+
+class DocumentCache:
+    """
+    Read-through cache of point lookups on the fields in DOC_CACHE_KEYS, one LRU per
+    collection. Writes through the database invalidate the affected keys locally and
+    broadcast them on DOC_CACHE_CHANNEL so every other process drops them too. The
+    asyncio database broadcasts through `async_redis` so writes never block the loop,
+    and the listener holds its connection from the `subscriber` pool.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        async_redis: AsyncRedis = None,
+        subscriber: Redis = None,
+        keys: dict = DOC_CACHE_KEYS,
+        maxsize: int = DOC_CACHE_SIZE,
+        ttl: float = DOC_CACHE_TTL,
+    ):
+        self.redis = redis
+        self.async_redis = async_redis
+        self.subscriber = subscriber or redis
+        self.keys = keys
+        self.caches = {collection: LRUCache(maxsize, ttl) for collection in keys}
+        self.origin = uuid.uuid4().hex
+        self._pid = None
+        self._listener = None
+
+    def _point_key(self, collection: str, query: dict):
+        """Return the cache key of a `{field: value}` query on the collection's key field."""
+        field = self.keys.get(collection)
+        if field is None or not query or list(query) != [field]:
+            return None
+        value = query[field]
+        if isinstance(value, (dict, list)):
+            return None
+        return str(value)
+
+    def get(self, collection: str, query: dict, subscribe: bool = True):
+        """
+        Return the cached documents of a point query. Without `subscribe`, as on the
+        event loop, a process that is not listening yet only misses.
+        """
+        key = self._point_key(collection, query)
+        if key is None:
+            return None
+        if subscribe:
+            self.listen()
+        elif self._pid != os.getpid():
+            return None
+        docs = self.caches[collection].get(key)
+        return copy.deepcopy(docs) if docs is not None else None
+
+    def set(self, collection: str, query: dict, docs: list):
+        key = self._point_key(collection, query)
+        if key is None or not docs:
+            return
+        self.caches[collection].set(key, copy.deepcopy(docs))
+
+    def _invalidation(
+        self, collection: str, query: dict, update: dict, docs: list
+    ) -> str:
+        """Drop the entries a write may have changed and return the broadcast payload."""
+        field = self.keys.get(collection)
+        if field is None:
+            return None
+        if docs is not None:
+            keys = [doc.get(field) for doc in docs]
+            keys = None if None in keys else [str(key) for key in keys]
+        else:
+            key = self._point_key(collection, query)
+            keys = None if key is None or field in (update or {}) else [key]
+
+        self._drop(collection, keys)
+        return json.dumps(
+            {"origin": self.origin, "collection": collection, "keys": keys}
+        )
+
+    def invalidate(
+        self,
+        collection: str,
+        query: dict = None,
+        update: dict = None,
+        docs: list = None,
+    ):
+        """Drop the entries a write may have changed, the whole collection if unsure."""
+        payload = self._invalidation(collection, query, update, docs)
+        if payload is None:
+            return
+        try:
+            self.redis.publish(DOC_CACHE_CHANNEL, payload)
+        except Exception as e:
+            logger.error(f"Failed to broadcast document cache invalidation: {e}")
+
+    async def ainvalidate(
+        self,
+        collection: str,
+        query: dict = None,
+        update: dict = None,
+        docs: list = None,
+    ):
+        """Asyncio counterpart of invalidate."""
+        payload = self._invalidation(collection, query, update, docs)
+        if payload is None:
+            return
+        try:
+            if self.async_redis is not None:
+                await self.async_redis.publish(DOC_CACHE_CHANNEL, payload)
+            else:
+                await asyncio.to_thread(self.redis.publish, DOC_CACHE_CHANNEL, payload)
+        except Exception as e:
+            logger.error(f"Failed to broadcast document cache invalidation: {e}")
+
+    def _drop(self, collection: str, keys: list = None):
+        cache = self.caches[collection]
+        if keys is None:
+            cache.clear()
+            return
+        for key in keys:
+            cache.delete(key)
+
+    def _on_message(self, message: dict):
+        try:
+            payload = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        if payload.get("origin") != self.origin and payload.get("collection") in (
+            self.caches
+        ):
+            self._drop(payload["collection"], payload.get("keys"))
+
+    def listen(self):
+        """Start the invalidation listener, again after a fork since threads do not survive it."""
+        if self._pid == os.getpid():
+            return
+        for cache in self.caches.values():
+            cache.clear()
+        try:
+            pubsub = self.subscriber.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{DOC_CACHE_CHANNEL: self._on_message})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            self._pid = os.getpid()
+        except Exception as e:
+            logger.error(f"Failed to subscribe to document cache invalidations: {e}")
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
+        self._pid = None
+
+    def stats(self) -> dict:
+        return {collection: cache.stats() for collection, cache in self.caches.items()}
@@ -0,0 +1,126 @@
+import math
+import logging
+from pymongo import DESCENDING
+from .params import TABLE, CHAT_BUCKET_SIZE, CHAT_HISTORY_LIMIT, CHAT_APPEND_RETRIES
+from .utils import get_curr_str_time
+from .database import MongoDBDatabase, AsyncMongoDBDatabase
+
+logger = logging.getLogger(__name__)
+
+# Served by the unique (resume_id, bucket) index
+LATEST_BUCKET = [("bucket", DESCENDING)]
+
+
+def new_message(sender: str, content: str) -> dict:
+    return {"sender": sender, "content": content, "time": get_curr_str_time()}
+
+
+async def append_messages(
+    async_db: AsyncMongoDBDatabase, resume_id: str, messages: list
+) -> int:
+    """
+    Append messages to the newest bucket of a conversation, opening the next bucket
+    once it is full. Return the bucket written, or None if every attempt failed.
+    """
+    # A legacy single-document conversation has no bucket and is left as it is
+    latest = await async_db.select_data(
+        TABLE.CHAT.value,
+        {"resume_id": resume_id, "bucket": {"$exists": True}},
+        {"_id": 0, "bucket": 1, "count": 1},
+        sort=LATEST_BUCKET,
+        limit=1,
+    )
+    bucket = latest[0]["bucket"] if latest else 0
+    if latest and latest[0]["count"] + len(messages) > CHAT_BUCKET_SIZE:
+        bucket += 1
+
+    for _ in range(CHAT_APPEND_RETRIES):
+        # The count guard makes a concurrent writer that filled the bucket first
+        # collide with the unique index, in which case we move on to the next one
+        appended = await async_db.push_data(
+            TABLE.CHAT.value,
+            {
+                "resume_id": resume_id,
+                "bucket": bucket,
+                "count": {"$lte": CHAT_BUCKET_SIZE - len(messages)},
+            },
+            "messages",
+            messages,
+            inc={"count": len(messages)},
+            on_insert={"created_at": get_curr_str_time()},
+            upsert=True,
+        )
+        if appended:
+            return bucket
+        bucket += 1
+
+    logger.error(f"Failed to append {len(messages)} messages for {resume_id}")
+    return None
+
+
+async def recent_messages(
+    async_db: AsyncMongoDBDatabase, resume_id: str, limit: int = CHAT_HISTORY_LIMIT
+) -> list:
+    """
+    Return the last `limit` messages of a conversation, oldest first. A legacy document
+    not migrated yet sorts after the buckets and supplies the oldest messages.
+    """
+    buckets = await async_db.select_data(
+        TABLE.CHAT.value,
+        {"resume_id": resume_id},
+        {
+            "_id": 0,
+            "bucket": 1,
+            "messages": {"$slice": -limit},
+            "chat_hist": {"$slice": -limit},
+        },
+        sort=LATEST_BUCKET,
+        limit=math.ceil(limit / CHAT_BUCKET_SIZE) + 2,
+    )
+    history = []
+    for bucket in buckets or []:
+        history = bucket.get("messages", bucket.get("chat_hist", [])) + history
+        if len(history) >= limit:
+            break
+    return history[-limit:]
+
+
+async def load_chat(
+    async_db: AsyncMongoDBDatabase, resume_id: str, limit: int = CHAT_HISTORY_LIMIT
+) -> dict:
+    """Return the recent conversation in the legacy `chat_hist` shape the chat model reads."""
+    return {
+        "resume_id": resume_id,
+        "chat_hist": await recent_messages(async_db, resume_id, limit),
+    }
+
+
+def split_into_buckets(chat: dict) -> list:
+    """Convert a legacy single-document conversation into bucket documents."""
+    messages = chat.get("chat_hist", [])
+    created_at = chat.get("created_at") or get_curr_str_time()
+    return [
+        {
+            "resume_id": chat["resume_id"],
+            "bucket": bucket,
+            "count": len(messages[start : start + CHAT_BUCKET_SIZE]),
+            "messages": messages[start : start + CHAT_BUCKET_SIZE],
+            "created_at": created_at,
+        }
+        for bucket, start in enumerate(range(0, len(messages), CHAT_BUCKET_SIZE))
+    ]
+
+
+if __name__ == "__main__":
+    # Migrate conversations stored as one ever-growing `chat_hist` document
+    logging.basicConfig(level=logging.INFO)
+    db = MongoDBDatabase()
+    db.create_connection()
+    migrated = 0
+    for chat in db.iter_data(TABLE.CHAT.value, {"bucket": {"$exists": False}}):
+        for bucket in split_into_buckets(chat):
+            db.insert_data(TABLE.CHAT.value, bucket)
+        db.delete_data(TABLE.CHAT.value, {"_id": chat["_id"]})
+        migrated += 1
+    logger.info(f"Migrated {migrated} conversations to bucketed storage")
+    db.close_connection()
@@ -0,0 +1,305 @@
+import os
+import time
+import logging
+import threading
+from pymongo import MongoClient, monitoring
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis import Redis, ConnectionPool, BlockingConnectionPool
+from redis.asyncio import Redis as AsyncRedis
+from redis.asyncio import ConnectionPool as AsyncConnectionPool
+from redis.asyncio import BlockingConnectionPool as AsyncBlockingConnectionPool
+from redis.exceptions import ConnectionError
+from .params import (
+    REDIS_HOST,
+    REDIS_POST,
+    MONGO_HOST,
+    MONGO_POST,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_SUBSCRIBER_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_CONNECT_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMeter:
+    """Checkout, wait and saturation counters of one connection pool."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.checkouts = 0
+        self.failures = 0
+        self.in_use = 0
+        self.peak = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def checked_out(self, wait: float):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def checked_in(self):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "in_use": self.in_use,
+            "peak": self.peak,
+            "saturation": round(self.in_use / self.max_size, 4),
+            "checkouts": self.checkouts,
+            "failures": self.failures,
+            "wait_avg": (
+                round(self.wait_total / self.checkouts, 6) if self.checkouts else None
+            ),
+            "wait_max": round(self.wait_max, 6),
+        }
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Feed the pymongo connection pool events of a client into a PoolMeter."""
+
+    def __init__(self, meter: PoolMeter):
+        self.meter = meter
+
+    def connection_checked_out(self, event):
+        self.meter.checked_out(event.duration)
+
+    def connection_check_out_failed(self, event):
+        self.meter.failed()
+
+    def connection_checked_in(self, event):
+        self.meter.checked_in()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+class _MeteredPool:
+    """Feed the checkouts of a Redis pool into a PoolMeter."""
+
+    def reset(self):
+        super().reset()
+        # Also runs in a forked child, whose pool starts out empty
+        self.meter = PoolMeter(self.max_connections)
+
+    def get_connection(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except ConnectionError:
+            self.meter.failed()
+            raise
+        self.meter.checked_out(time.monotonic() - started)
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        self.meter.checked_in()
+
+
+class MeteredConnectionPool(_MeteredPool, BlockingConnectionPool):
+    """Blocking Redis pool, waits up to REDIS_POOL_TIMEOUT for a free connection."""
+
+
+class MeteredSubscriberPool(_MeteredPool, ConnectionPool):
+    """
+    Pool of the connections held open by pubsub and blocking reads. It never waits,
+    once REDIS_SUBSCRIBER_MAX_CONNECTIONS are in use a new subscriber fails at once.
+    """
+
+
+class _AsyncMeteredPool:
+    """Asyncio counterpart of _MeteredPool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.meter = PoolMeter(self.max_connections)
+
+    async def get_connection(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except ConnectionError:
+            self.meter.failed()
+            raise
+        self.meter.checked_out(time.monotonic() - started)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.meter.checked_in()
+
+
+class AsyncMeteredConnectionPool(_AsyncMeteredPool, AsyncBlockingConnectionPool):
+    """Asyncio counterpart of MeteredConnectionPool."""
+
+
+class AsyncMeteredSubscriberPool(_AsyncMeteredPool, AsyncConnectionPool):
+    """Asyncio counterpart of MeteredSubscriberPool."""
+
+
+# Clients of the current process. MongoClient is not fork-safe, so a forked child
+# builds its own, while Redis pools drop inherited connections by themselves
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+def _get_client(name: str, factory):
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            for inherited in [
+                n for n in _clients if n.startswith(("mongo:", "motor:"))
+            ]:
+                del _clients[inherited]
+            _clients_pid = os.getpid()
+        if name not in _clients:
+            _clients[name] = factory()
+            logger.info(f"Created {name} connection pool in process {_clients_pid}")
+        return _clients[name][0]
+
+
+def _mongo_options(meter: PoolMeter) -> dict:
+    return {
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [MongoPoolListener(meter)],
+    }
+
+
+def get_mongo_client(host: str = MONGO_HOST, port: int = MONGO_POST) -> MongoClient:
+    """Return the pooled MongoClient of this process."""
+
+    def factory():
+        meter = PoolMeter(MONGO_MAX_POOL_SIZE)
+        client = MongoClient(f"mongodb://{host}:{port}/", **_mongo_options(meter))
+        return client, meter
+
+    return _get_client(f"mongo:{host}:{port}", factory)
+
+
+def get_async_mongo_client(
+    host: str = MONGO_HOST, port: int = MONGO_POST
+) -> AsyncIOMotorClient:
+    """Return the pooled motor client of this process."""
+
+    def factory():
+        meter = PoolMeter(MONGO_MAX_POOL_SIZE)
+        client = AsyncIOMotorClient(
+            f"mongodb://{host}:{port}/", **_mongo_options(meter)
+        )
+        return client, meter
+
+    return _get_client(f"motor:{host}:{port}", factory)
+
+
+def _redis_options(decode_responses: bool, subscriber: bool) -> dict:
+    options = {
+        "host": REDIS_HOST,
+        "port": REDIS_POST,
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "timeout": REDIS_POOL_TIMEOUT,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "decode_responses": decode_responses,
+    }
+    if subscriber:
+        options["max_connections"] = REDIS_SUBSCRIBER_MAX_CONNECTIONS
+        del options["timeout"]
+    return options
+
+
+def get_redis(decode_responses: bool = True, subscriber: bool = False) -> Redis:
+    """
+    Return the pooled Redis client of this process, RQ needs `decode_responses=False`.
+    Pubsub and blocking reads hold their connection indefinitely, so they go through
+    the separate `subscriber` pool instead of starving the shared one.
+    """
+
+    def factory():
+        pool_class = MeteredSubscriberPool if subscriber else MeteredConnectionPool
+        pool = pool_class(**_redis_options(decode_responses, subscriber))
+        return Redis(connection_pool=pool), pool
+
+    kind = "redis_subscriber" if subscriber else "redis"
+    return _get_client(f"{kind}:decode={decode_responses}", factory)
+
+
+def get_async_redis(
+    decode_responses: bool = True, subscriber: bool = False
+) -> AsyncRedis:
+    """Return the pooled asyncio Redis client of this process, see get_redis."""
+
+    def factory():
+        pool_class = (
+            AsyncMeteredSubscriberPool if subscriber else AsyncMeteredConnectionPool
+        )
+        pool = pool_class(**_redis_options(decode_responses, subscriber))
+        return AsyncRedis(connection_pool=pool), pool
+
+    kind = "async_redis_subscriber" if subscriber else "async_redis"
+    return _get_client(f"{kind}:decode={decode_responses}", factory)
+
+
+def pool_stats() -> dict:
+    """Report the pool counters of every client created by this process."""
+    with _clients_lock:
+        return {
+            name: getattr(source, "meter", source).stats()
+            for name, (_, source) in _clients.items()
+        }
+
+
+def close_clients():
+    """Close the clients of this process at shutdown, asyncio Redis is closed by its owner."""
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid == os.getpid():
+            for client, _ in _clients.values():
+                if not isinstance(client, AsyncRedis):
+                    client.close()
+        _clients.clear()
+        _clients_pid = None
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from bson import ObjectId
+from pymongo import DESCENDING
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from .params import (
+    TABLE,
+    DASHBOARD_PAGE_SIZE,
+    DASHBOARD_MAX_LIMIT,
+    DASHBOARD_VERSION_KEY,
+)
+from .database import AsyncMongoDBDatabase
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Newest documents first, served by the default `_id` index
+NEWEST_FIRST = [("_id", DESCENDING)]
+
+# Only the columns each section shows
+RESUME_COLUMNS = {
+    "name": 1,
+    "status": 1,
+    "information": 1,
+    "phone": 1,
+    "email": 1,
+    "expectation": 1,
+    "education": 1,
+    "certificate": 1,
+    "language": 1,
+    "skills": 1,
+    "self_assessment": 1,
+    "work_experience": 1,
+    "project_experience": 1,
+    "created_at": 1,
+}
+
+JOB_COLUMNS = {
+    "title": 1,
+    "company": 1,
+    "city": 1,
+    "salary": 1,
+    "created_at": 1,
+}
+
+TASK_COLUMNS = {
+    "task_id": 1,
+    "status": 1,
+    "created_at": 1,
+}
+
+SECTIONS = {
+    TABLE.RESUME.value: RESUME_COLUMNS,
+    TABLE.JOB.value: JOB_COLUMNS,
+    TABLE.TASK.value: TASK_COLUMNS,
+}
+
+# Rendered by templates/main.html, the other sections are only served by /main/{section}
+MAIN_SECTIONS = (TABLE.RESUME.value,)
+
+
+def touch_dashboard(redis: Redis, *collections: str):
+    """Bump the version of the given collections so every process drops its cached pages."""
+    pipe = redis.pipeline()
+    for collection in collections:
+        pipe.hincrby(DASHBOARD_VERSION_KEY, collection, 1)
+    pipe.execute()
+
+
+def decode_cursor(cursor: str) -> ObjectId:
+    """Return the `_id` a page ended at, raise ValueError if malformed."""
+    if not ObjectId.is_valid(cursor):
+        raise ValueError(f"Invalid cursor {cursor}")
+    return ObjectId(cursor)
+
+
+async def load_page(
+    async_db: AsyncMongoDBDatabase,
+    cache: LRUCache,
+    collection: str,
+    cursor: str = None,
+    limit: int = DASHBOARD_PAGE_SIZE,
+    version: str = "0",
+) -> dict:
+    """Return one newest-first page of a dashboard section with its total count."""
+    limit = max(1, min(limit, DASHBOARD_MAX_LIMIT))
+    query = {"_id": {"$lt": decode_cursor(cursor)}} if cursor else {}
+
+    key = (collection, cursor, limit, version)
+    page = cache.get(key)
+    if page is not None:
+        return page
+
+    items, total = await asyncio.gather(
+        async_db.select_data(
+            collection, query, SECTIONS[collection], sort=NEWEST_FIRST, limit=limit + 1
+        ),
+        async_db.count_data(collection),
+    )
+    items = items or []
+    has_more = len(items) > limit
+    items = items[:limit]
+    for item in items:
+        item["_id"] = str(item["_id"])
+
+    page = {
+        "items": items,
+        "total": total or 0,
+        "next_cursor": items[-1]["_id"] if has_more else None,
+    }
+    cache.set(key, page)
+    return page
+
+
+async def load_dashboard(
+    async_db: AsyncMongoDBDatabase,
+    async_redis: AsyncRedis,
+    cache: LRUCache,
+    cursors: dict = {},
+    limit: int = DASHBOARD_PAGE_SIZE,
+    sections: tuple = MAIN_SECTIONS,
+) -> dict:
+    """Return the current page of the given dashboard sections, keyed by collection."""
+    versions = await async_redis.hgetall(DASHBOARD_VERSION_KEY)
+    pages = await asyncio.gather(
+        *(
+            load_page(
+                async_db,
+                cache,
+                collection,
+                cursors.get(collection),
+                limit,
+                versions.get(collection, "0"),
+            )
+            for collection in sections
+        )
+    )
+    return dict(zip(sections, pages))
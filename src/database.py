@@ -1,12 +1,41 @@
 import os
+import time
 import logging
-from pymongo import MongoClient, UpdateOne
-from pymongo.errors import DuplicateKeyError, OperationFailure
-from .params import MONGO_HOST, MONGO_POST, DB_NAME
+import threading
+from typing import AsyncIterator, Iterator
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from .params import (
+    MONGO_HOST,
+    MONGO_POST,
+    DB_NAME,
+    BULK_BATCH_SIZE,
+    BULK_FLUSH_INTERVAL,
+    CURSOR_BATCH_SIZE,
+    CURSOR_PAGE_SIZE,
+)
+from .utils import get_content_hash
+from .connection import get_mongo_client, get_async_mongo_client
+from .metrics import counter, histogram
 
 
 logger = logging.getLogger(__name__)
 
+BULK_WRITE_SECONDS = histogram(
+    "mongo_bulk_write_seconds", "Latency of one bulk upsert", ("collection",)
+)
+BULK_RECORDS = counter(
+    "mongo_bulk_records_total",
+    "Records passed to bulk upserts by result",
+    ("collection", "result"),
+)
+
+
+def _record_bulk(collection: str, stats: dict):
+    for result, count in stats.items():
+        if count:
+            BULK_RECORDS.inc(collection, result, amount=count)
+
 
 class MongoDBDatabase:
     def __init__(
@@ -15,19 +44,22 @@ class MongoDBDatabase:
         database: str = DB_NAME,
         port: int = MONGO_POST,
         debug: bool = False,
+        cache=None,
     ):
         """Initialize the MongoDBDatabase class with the connection parameters"""
         self.host = host
         self.database = database
         self.port = port
         self.debug = debug
+        # Optional DocumentCache serving point lookups, invalidated by every write
+        self.cache = cache
         self.client = None
         self.db = None
 
     def create_connection(self):
         """Create and return a MongoDB database connection"""
         try:
-            self.client = MongoClient(f"mongodb://{self.host}:{self.port}/")
+            self.client = get_mongo_client(self.host, self.port)
             self.db = self.client[self.database]
             logger.info(
                 f"Successfully connected to the MongoDB database {self.database} on port {self.port}"
@@ -46,13 +78,102 @@ class MongoDBDatabase:
         try:
             collection_obj = self.db[collection]
             inserted = collection_obj.insert_one(data)
-            logger.info(f"Document inserted with _id: {inserted.inserted_id}")
+            self._invalidate(collection, docs=[data])
+            logger.info(
+                f"Document inserted with _id: {inserted.inserted_id}",
+                extra={"sample": True},
+            )
         except DuplicateKeyError as e:
             logger.error(f"Duplicate key error: {e}")
         except Exception as e:
             logger.error(f"Error inserting data into {collection}: {e}")
 
-    def select_data(self, collection: str, query: dict = {}, projection: dict = None):
+    def bulk_upsert(
+        self,
+        collection: str,
+        records: list,
+        keys: tuple = ("resume_id",),
+        hash_field: str = None,
+    ) -> dict:
+        """
+        Upsert documents with one unordered bulk write, keyed on the given fields.
+        If `hash_field` is set, documents whose stored hash is unchanged are skipped.
+        Return the number of inserted, updated and skipped documents.
+        """
+        stats = {"inserted": 0, "updated": 0, "skipped": 0}
+        if self.db is None:
+            logger.error("No active database connection.")
+            return stats
+
+        # Later records win over earlier ones with the same key
+        latest = {tuple(record[k] for k in keys): record for record in records}
+        stats["skipped"] = len(records) - len(latest)
+
+        try:
+            collection_obj = self.db[collection]
+            if hash_field and latest:
+                for doc in collection_obj.find(
+                    self._keys_query(keys, latest), {k: 1 for k in (*keys, hash_field)}
+                ):
+                    key = tuple(doc.get(k) for k in keys)
+                    if key in latest and latest[key].get(hash_field) == doc.get(
+                        hash_field
+                    ):
+                        del latest[key]
+                        stats["skipped"] += 1
+
+            if not latest:
+                _record_bulk(collection, stats)
+                return stats
+
+            requests = []
+            for key, record in latest.items():
+                record = {k: v for k, v in record.items() if k != "_id"}
+                on_insert = (
+                    {"created_at": record.pop("created_at")}
+                    if "created_at" in record
+                    else {}
+                )
+                update = {"$set": record}
+                if on_insert:
+                    update["$setOnInsert"] = on_insert
+                requests.append(UpdateOne(dict(zip(keys, key)), update, upsert=True))
+
+            with BULK_WRITE_SECONDS.time(collection):
+                result = collection_obj.bulk_write(requests, ordered=False)
+            stats["inserted"] += result.upserted_count
+            stats["updated"] += result.modified_count
+            logger.info(
+                f"Bulk upserted into {collection}: {stats['inserted']} inserted, "
+                f"{stats['updated']} updated, {stats['skipped']} skipped."
+            )
+        except BulkWriteError as e:
+            stats["inserted"] += e.details.get("nUpserted", 0)
+            stats["updated"] += e.details.get("nModified", 0)
+            logger.error(
+                f"Bulk write into {collection} partially failed: {len(e.details.get('writeErrors', []))} errors"
+            )
+        except Exception as e:
+            logger.error(f"Error bulk upserting data into {collection}: {e}")
+        self._invalidate(collection, docs=[dict(zip(keys, key)) for key in latest])
+        _record_bulk(collection, stats)
+        return stats
+
+    @staticmethod
+    def _keys_query(keys: tuple, records: dict) -> dict:
+        """Build a query matching every key tuple of the given records."""
+        if len(keys) == 1:
+            return {keys[0]: {"$in": [key[0] for key in records]}}
+        return {"$or": [dict(zip(keys, key)) for key in records]}
+
+    def select_data(
+        self,
+        collection: str,
+        query: dict = {},
+        projection: dict = None,
+        sort: list = None,
+        limit: int = 0,
+    ):
         """
         Select data using a query and return the result
         """
@@ -60,15 +181,88 @@ class MongoDBDatabase:
             logger.error("No active database connection.")
             return None
 
+        cacheable = self.cache is not None and not (projection or sort or limit)
+        if cacheable:
+            cached = self.cache.get(collection, query)
+            if cached is not None:
+                return cached
+
         try:
             collection_obj = self.db[collection]
-            result = collection_obj.find(query, projection)
-            return list(result)
+            result = list(
+                collection_obj.find(query, projection, sort=sort, limit=limit)
+            )
+            if cacheable:
+                self.cache.set(collection, query, result)
+            return result
         except Exception as e:
             logger.error(f"Error querying data from {collection}: {e}")
             return None
 
-    def update_data(self, collection: str, query: dict, update: dict):
+    def count_data(self, collection: str, query: dict = {}):
+        """
+        Count the documents matching the query, from the collection metadata if unfiltered
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return None
+
+        try:
+            collection_obj = self.db[collection]
+            if not query:
+                return collection_obj.estimated_document_count()
+            return collection_obj.count_documents(query)
+        except Exception as e:
+            logger.error(f"Error counting data in {collection}: {e}")
+            return None
+
+    def iter_data(
+        self,
+        collection: str,
+        query: dict = {},
+        projection: dict = None,
+        batch_size: int = CURSOR_BATCH_SIZE,
+        page_size: int = CURSOR_PAGE_SIZE,
+    ) -> Iterator[dict]:
+        """
+        Stream the documents matching the query in `_id` order without loading them all.
+        Pages are fetched by keyset pagination on `_id`, so no cursor is held open for
+        long and `_id` is always returned.
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return
+
+        if projection is not None and not projection.get("_id", 1):
+            projection = {k: v for k, v in projection.items() if k != "_id"} or None
+
+        collection_obj = self.db[collection]
+        last_id = None
+        while True:
+            page_query = query
+            if last_id is not None:
+                page_query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+            try:
+                cursor = (
+                    collection_obj.find(page_query, projection)
+                    .sort("_id", ASCENDING)
+                    .limit(page_size)
+                    .batch_size(batch_size)
+                )
+                count = 0
+                for doc in cursor:
+                    count += 1
+                    last_id = doc["_id"]
+                    yield doc
+            except Exception as e:
+                logger.error(f"Error streaming data from {collection}: {e}")
+                return
+            if count < page_size:
+                return
+
+    def update_data(
+        self, collection: str, query: dict, update: dict, upsert: bool = False
+    ):
         """
         Update data in the specified collection based on the query
         """
@@ -78,13 +272,47 @@ class MongoDBDatabase:
 
         try:
             collection_obj = self.db[collection]
-            result = collection_obj.update_many(query, {"$set": update})
+            result = collection_obj.update_many(query, {"$set": update}, upsert=upsert)
+            self._invalidate(collection, query, update)
             logger.info(f"Updated {result.modified_count} documents in {collection}.")
         except OperationFailure as e:
             logger.error(f"Error updating data in {collection}: {e}")
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
 
+    def push_data(
+        self,
+        collection: str,
+        query: dict,
+        field: str,
+        values: list,
+        inc: dict = None,
+        on_insert: dict = None,
+        upsert: bool = False,
+    ) -> bool:
+        """
+        Append values to an array field of the first document matching the query.
+        Return False if nothing matched, or if the upsert collided with a unique index.
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return False
+
+        update = {"$push": {field: {"$each": values}}}
+        if inc:
+            update["$inc"] = inc
+        if on_insert:
+            update["$setOnInsert"] = on_insert
+        try:
+            result = self.db[collection].update_one(query, update, upsert=upsert)
+            self._invalidate(collection, query, {field: values})
+            return bool(result.matched_count or result.upserted_id)
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            logger.error(f"Error pushing data into {collection}: {e}")
+            return False
+
     def delete_data(self, collection: str, query: dict):
         """
         Delete data from the specified collection based on the query
@@ -96,15 +324,323 @@ class MongoDBDatabase:
         try:
             collection_obj = self.db[collection]
             result = collection_obj.delete_many(query)
+            self._invalidate(collection, query)
+            logger.info(f"Deleted {result.deleted_count} documents from {collection}.")
+        except Exception as e:
+            logger.error(f"Error deleting data from {collection}: {e}")
+
+    def close_connection(self):
+        """Release the MongoDB connection, the pooled client stays open for reuse"""
+        if self.client:
+            self.client = None
+            self.db = None
+            logger.info("MongoDB connection released.")
+
+    def _invalidate(
+        self, collection: str, query: dict = None, update: dict = None, docs=None
+    ):
+        """Drop the cached documents a write may have changed."""
+        if self.cache is not None:
+            self.cache.invalidate(collection, query, update, docs)
+
+
+class AsyncMongoDBDatabase:
+    """Asyncio counterpart of MongoDBDatabase for the FastAPI handlers, backed by motor."""
+
+    def __init__(
+        self,
+        host: str = MONGO_HOST,
+        database: str = DB_NAME,
+        port: int = MONGO_POST,
+        debug: bool = False,
+        cache=None,
+    ):
+        self.host = host
+        self.database = database
+        self.port = port
+        self.debug = debug
+        # Optional DocumentCache serving point lookups, invalidated by every write
+        self.cache = cache
+        self.client = None
+        self.db = None
+
+    def create_connection(self):
+        """Create and return an asynchronous MongoDB client"""
+        try:
+            self.client = get_async_mongo_client(self.host, self.port)
+            self.db = self.client[self.database]
+            logger.info(
+                f"Successfully connected to the MongoDB database {self.database} on port {self.port} (async)"
+            )
+        except Exception as e:
+            logger.error(f"Failed to connect to MongoDB: {e}")
+            self.client = None
+        return self.client
+
+    async def insert_data(self, collection: str, data: dict):
+        """Insert a document into the specified collection"""
+        if self.db is None:
+            logger.error("No active database connection.")
+            return
+
+        try:
+            inserted = await self.db[collection].insert_one(data)
+            await self._invalidate(collection, docs=[data])
+            logger.info(
+                f"Document inserted with _id: {inserted.inserted_id}",
+                extra={"sample": True},
+            )
+        except DuplicateKeyError as e:
+            logger.error(f"Duplicate key error: {e}")
+        except Exception as e:
+            logger.error(f"Error inserting data into {collection}: {e}")
+
+    async def select_data(
+        self,
+        collection: str,
+        query: dict = {},
+        projection: dict = None,
+        sort: list = None,
+        limit: int = 0,
+    ):
+        """
+        Select data using a query and return the result
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return None
+
+        cacheable = self.cache is not None and not (projection or sort or limit)
+        if cacheable:
+            cached = self.cache.get(collection, query, subscribe=False)
+            if cached is not None:
+                return cached
+
+        try:
+            cursor = self.db[collection].find(query, projection, sort=sort, limit=limit)
+            result = await cursor.to_list(length=None)
+            if cacheable:
+                self.cache.set(collection, query, result)
+            return result
+        except Exception as e:
+            logger.error(f"Error querying data from {collection}: {e}")
+            return None
+
+    async def count_data(self, collection: str, query: dict = {}):
+        """
+        Count the documents matching the query, from the collection metadata if unfiltered
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return None
+
+        try:
+            collection_obj = self.db[collection]
+            if not query:
+                return await collection_obj.estimated_document_count()
+            return await collection_obj.count_documents(query)
+        except Exception as e:
+            logger.error(f"Error counting data in {collection}: {e}")
+            return None
+
+    async def iter_data(
+        self,
+        collection: str,
+        query: dict = {},
+        projection: dict = None,
+        batch_size: int = CURSOR_BATCH_SIZE,
+        page_size: int = CURSOR_PAGE_SIZE,
+    ) -> AsyncIterator[dict]:
+        """Stream the documents matching the query in `_id` order, see MongoDBDatabase.iter_data"""
+        if self.db is None:
+            logger.error("No active database connection.")
+            return
+
+        if projection is not None and not projection.get("_id", 1):
+            projection = {k: v for k, v in projection.items() if k != "_id"} or None
+
+        collection_obj = self.db[collection]
+        last_id = None
+        while True:
+            page_query = query
+            if last_id is not None:
+                page_query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+            try:
+                cursor = (
+                    collection_obj.find(page_query, projection)
+                    .sort("_id", ASCENDING)
+                    .limit(page_size)
+                    .batch_size(batch_size)
+                )
+                count = 0
+                async for doc in cursor:
+                    count += 1
+                    last_id = doc["_id"]
+                    yield doc
+            except Exception as e:
+                logger.error(f"Error streaming data from {collection}: {e}")
+                return
+            if count < page_size:
+                return
+
+    async def update_data(
+        self, collection: str, query: dict, update: dict, upsert: bool = False
+    ):
+        """
+        Update data in the specified collection based on the query
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return
+
+        try:
+            result = await self.db[collection].update_many(
+                query, {"$set": update}, upsert=upsert
+            )
+            await self._invalidate(collection, query, update)
+            logger.info(f"Updated {result.modified_count} documents in {collection}.")
+        except OperationFailure as e:
+            logger.error(f"Error updating data in {collection}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+
+    async def push_data(
+        self,
+        collection: str,
+        query: dict,
+        field: str,
+        values: list,
+        inc: dict = None,
+        on_insert: dict = None,
+        upsert: bool = False,
+    ) -> bool:
+        """
+        Append values to an array field of the first document matching the query.
+        Return False if nothing matched, or if the upsert collided with a unique index.
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return False
+
+        update = {"$push": {field: {"$each": values}}}
+        if inc:
+            update["$inc"] = inc
+        if on_insert:
+            update["$setOnInsert"] = on_insert
+        try:
+            result = await self.db[collection].update_one(query, update, upsert=upsert)
+            await self._invalidate(collection, query, {field: values})
+            return bool(result.matched_count or result.upserted_id)
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            logger.error(f"Error pushing data into {collection}: {e}")
+            return False
+
+    async def delete_data(self, collection: str, query: dict):
+        """
+        Delete data from the specified collection based on the query
+        """
+        if self.db is None:
+            logger.error("No active database connection.")
+            return
+
+        try:
+            result = await self.db[collection].delete_many(query)
+            await self._invalidate(collection, query)
             logger.info(f"Deleted {result.deleted_count} documents from {collection}.")
         except Exception as e:
             logger.error(f"Error deleting data from {collection}: {e}")
 
     def close_connection(self):
-        """Close the MongoDB connection"""
+        """Release the MongoDB connection, the pooled client stays open for reuse"""
         if self.client:
-            self.client.close()
-            logger.info("MongoDB connection closed.")
+            self.client = None
+            self.db = None
+            logger.info("MongoDB connection released (async).")
+
+    async def _invalidate(
+        self, collection: str, query: dict = None, update: dict = None, docs=None
+    ):
+        """Drop the cached documents a write may have changed."""
+        if self.cache is not None:
+            await self.cache.ainvalidate(collection, query, update, docs)
+
+
+class BulkUpserter:
+    """
+    Buffer documents and upsert them in batches, flushed by size or by age.
+    With `background` set, a timer thread also flushes a stale buffer while no new
+    documents arrive.
+    """
+
+    def __init__(
+        self,
+        db: MongoDBDatabase,
+        collection: str,
+        keys: tuple = ("resume_id",),
+        hash_field: str = None,
+        batch_size: int = BULK_BATCH_SIZE,
+        flush_interval: float = BULK_FLUSH_INTERVAL,
+        background: bool = False,
+    ):
+        self.db = db
+        self.collection = collection
+        self.keys = keys
+        self.hash_field = hash_field
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background = background
+        self.stats = {"inserted": 0, "updated": 0, "skipped": 0}
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def add(self, record: dict):
+        """Queue a document, flushing the buffer once it is full or stale."""
+        if self.hash_field:
+            record[self.hash_field] = get_content_hash(record)
+        with self._lock:
+            self._buffer.append(record)
+            if (
+                len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
+
+    def flush(self):
+        """Write out all buffered documents."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return
+            records, self._buffer = self._buffer, []
+            stats = self.db.bulk_upsert(
+                self.collection, records, self.keys, self.hash_field
+            )
+            for k, v in stats.items():
+                self.stats[k] += v
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def __enter__(self):
+        if self.background:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, daemon=True
+            )
+            self._flusher.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
 
 
 if __name__ == "__main__":
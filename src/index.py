@@ -0,0 +1,186 @@
+import re
+import math
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from collections import Counter
+from operator import itemgetter
+from .params import TABLE, INDEX_BM25_K1, INDEX_BM25_B, INDEX_REFRESH_OVERLAP
+from .utils import get_curr_str_time
+from .database import MongoDBDatabase, BulkUpserter
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+logger = logging.getLogger(__name__)
+
+_CJK = re.compile(r"[一-鿿]+")
+_WORD = re.compile(r"[a-z][a-z0-9+#.]*[a-z0-9+#]|[a-z]")
+
+
+def tokenize(text: str) -> list:
+    """Split text into lowercase terms, segmenting Chinese with jieba or character bigrams."""
+    text = text.lower()
+    terms = _WORD.findall(text)
+    for run in _CJK.findall(text):
+        if jieba is not None:
+            terms.extend(t for t in jieba.cut(run) if len(t) > 1)
+        elif len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _flatten(value) -> list:
+    """Collect every string nested inside a document field."""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [s for v in value.values() for s in _flatten(v)]
+    if isinstance(value, list):
+        return [s for v in value for s in _flatten(v)]
+    return []
+
+
+RESUME_TEXT_FIELDS = (
+    "expectation",
+    "skills",
+    "self_assessment",
+    "work_experience",
+    "project_experience",
+)
+JOB_TEXT_FIELDS = ("title", "requirements", "responsibilities")
+
+
+def resume_text(resume: dict) -> str:
+    return " ".join(s for f in RESUME_TEXT_FIELDS for s in _flatten(resume.get(f)))
+
+
+def job_text(job: dict) -> str:
+    return " ".join(s for f in JOB_TEXT_FIELDS for s in _flatten(job.get(f)))
+
+
+def build_terms_doc(resume: dict) -> dict:
+    """Return the `resume_terms` document indexing a resume."""
+    terms = Counter(tokenize(resume_text(resume)))
+    return {
+        "resume_id": resume["resume_id"],
+        # Stored as pairs since terms such as "node.js" are not valid field names
+        "terms": sorted(terms.items()),
+        "length": sum(terms.values()),
+        "updated_at": get_curr_str_time(),
+    }
+
+
+class TermsWriter(BulkUpserter):
+    """Buffered writer keeping `resume_terms` in sync with committed resumes."""
+
+    def __init__(self, db: MongoDBDatabase, **kwargs):
+        super().__init__(
+            db, TABLE.RESUME_TERMS.value, hash_field="content_hash", **kwargs
+        )
+
+    def add(self, resume: dict):
+        super().add(build_terms_doc(resume))
+
+    def flush(self):
+        with self._lock:
+            # Stamped when written, so a document buffered across a refresh is not
+            # older than what that refresh already loaded
+            now = get_curr_str_time()
+            for doc in self._buffer:
+                doc["updated_at"] = now
+            super().flush()
+
+
+class ResumeIndex:
+    """In-memory BM25 inverted index over `resume_terms`, refreshed incrementally."""
+
+    def __init__(self, k1: float = INDEX_BM25_K1, b: float = INDEX_BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_len = {}
+        self.total_len = 0
+        self.loaded_until = ""
+        self._lock = threading.Lock()
+
+    def _add(self, resume_id: str, terms: list, length: int):
+        self._remove(resume_id)
+        for term, tf in terms:
+            self.postings.setdefault(term, {})[resume_id] = tf
+        self.doc_terms[resume_id] = [term for term, _ in terms]
+        self.doc_len[resume_id] = length
+        self.total_len += length
+
+    def _remove(self, resume_id: str):
+        for term in self.doc_terms.pop(resume_id, ()):
+            postings = self.postings[term]
+            del postings[resume_id]
+            if not postings:
+                del self.postings[term]
+        self.total_len -= self.doc_len.pop(resume_id, 0)
+
+    def refresh(self, db: MongoDBDatabase):
+        """Load the term documents written since the last refresh, with some overlap."""
+        with self._lock:
+            since = self.loaded_until
+            if since:
+                since = (
+                    datetime.strptime(since, "%Y-%m-%d %H:%M:%S")
+                    - timedelta(seconds=INDEX_REFRESH_OVERLAP)
+                ).strftime("%Y-%m-%d %H:%M:%S")
+            docs = db.select_data(
+                TABLE.RESUME_TERMS.value,
+                {"updated_at": {"$gte": since}},
+                {"_id": 0, "resume_id": 1, "terms": 1, "length": 1, "updated_at": 1},
+            )
+            for doc in docs or []:
+                self._add(doc["resume_id"], doc["terms"], doc["length"])
+                self.loaded_until = max(self.loaded_until, doc["updated_at"])
+            if docs:
+                logger.info(
+                    f"Resume index refreshed with {len(docs)} documents, {len(self.doc_len)} in total."
+                )
+
+    def search(self, text: str, top_k: int) -> list:
+        """Return the `top_k` (resume_id, score) pairs most relevant to the text."""
+        with self._lock:
+            if not self.doc_len:
+                return []
+            n = len(self.doc_len)
+            avg_len = self.total_len / n or 1
+            scores = Counter()
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for resume_id, tf in postings.items():
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self.doc_len[resume_id] / avg_len
+                    )
+                    scores[resume_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            return heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+
+    def shortlist(self, db: MongoDBDatabase, job: dict, top_k: int) -> list:
+        """Refresh the index and return the `top_k` most relevant resumes for a job."""
+        self.refresh(db)
+        return self.search(job_text(job), top_k)
+
+
+if __name__ == "__main__":
+    # Rebuild `resume_terms` from every resume in the database
+    logging.basicConfig(level=logging.INFO)
+    db = MongoDBDatabase()
+    db.create_connection()
+    with TermsWriter(db) as writer:
+        for resume in db.iter_data(TABLE.RESUME.value):
+            writer.add(resume)
+    logger.info(f"Resume index rebuilt: {writer.stats}")
+    db.close_connection()
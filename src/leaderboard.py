@@ -0,0 +1,101 @@
+import json
+import base64
+import logging
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from .params import TABLE, LEADERBOARD_MAX_LIMIT
+from .database import MongoDBDatabase
+
+logger = logging.getLogger(__name__)
+
+# Served by the (job_id, initial_score desc, resume_id) index
+RANK_SORT = [("initial_score", DESCENDING), ("resume_id", ASCENDING)]
+
+SCORE_PROJECTION = {
+    "_id": 0,
+    "resume_id": 1,
+    "initial_score": 1,
+    "final_score": 1,
+    "status": 1,
+    "reason": 1,
+    "updated_at": 1,
+}
+
+RESUME_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "resume_id": 1,
+    "name": 1,
+    "status": 1,
+    "information": 1,
+    "expectation": 1,
+    "education": 1,
+    "skills": 1,
+}
+
+
+def encode_cursor(score: dict) -> str:
+    payload = json.dumps([score["initial_score"], score["resume_id"]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Return the (initial_score, resume_id) a page ended at, raise ValueError if malformed."""
+    try:
+        initial_score, resume_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except Exception:
+        raise ValueError(f"Invalid cursor {cursor}")
+    return initial_score, resume_id
+
+
+def top_candidates(
+    mongo_db: MongoDBDatabase,
+    job_id: ObjectId,
+    limit: int = 50,
+    min_score: float = None,
+    cursor: str = None,
+    with_resume: bool = False,
+) -> dict:
+    """Return one page of a job's candidates ranked by initial score."""
+    limit = max(1, min(limit, LEADERBOARD_MAX_LIMIT))
+    conditions = [{"job_id": job_id}]
+    if min_score is not None:
+        conditions.append({"initial_score": {"$gte": min_score}})
+    if cursor:
+        after_score, after_id = decode_cursor(cursor)
+        conditions.append(
+            {
+                "$or": [
+                    {"initial_score": {"$lt": after_score}},
+                    {"initial_score": after_score, "resume_id": {"$gt": after_id}},
+                ]
+            }
+        )
+
+    scores = (
+        mongo_db.select_data(
+            TABLE.SCORE.value,
+            {"$and": conditions},
+            SCORE_PROJECTION,
+            sort=RANK_SORT,
+            limit=limit + 1,
+        )
+        or []
+    )
+    has_more = len(scores) > limit
+    scores = scores[:limit]
+
+    if with_resume and scores:
+        resumes = mongo_db.select_data(
+            TABLE.RESUME.value,
+            {"resume_id": {"$in": [score["resume_id"] for score in scores]}},
+            RESUME_SUMMARY_PROJECTION,
+        )
+        summaries = {resume["resume_id"]: resume for resume in resumes or []}
+        for score in scores:
+            score["resume"] = summaries.get(score["resume_id"])
+
+    return {
+        "job_id": str(job_id),
+        "candidates": scores,
+        "next_cursor": encode_cursor(scores[-1]) if has_more else None,
+    }
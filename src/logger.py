@@ -1,8 +1,23 @@
 import os
+import copy
+import json
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import logging.config
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
-from .params import RQ_LOG_DIR, APP_LOG_DIR, SCRAPER_LOG_DIR
+from .params import (
+    RQ_LOG_DIR,
+    APP_LOG_DIR,
+    SCRAPER_LOG_DIR,
+    LOG_QUEUE,
+    LOG_JSON,
+    LOG_SAMPLE_BURST,
+    LOG_SAMPLE_INTERVAL,
+)
 
 
 def make_log_dir():
@@ -14,6 +29,88 @@ def make_log_dir():
 
 log_time = datetime.now().strftime("%Y%m%d_%H%M%S")
 
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SummaryFilter(logging.Filter):
+    """
+    Sample repetitive records. Hot call sites opt in with `extra={"sample": True}`,
+    each passes `burst` records per `interval` seconds at INFO or below and the rest
+    are dropped. The dropped count is appended to the site's next record, or logged on
+    its own by `flush` once the interval is over.
+    """
+
+    def __init__(
+        self, burst: int = LOG_SAMPLE_BURST, interval: float = LOG_SAMPLE_INTERVAL
+    ):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not getattr(record, "sample", False):
+            return True
+        key = (record.name, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, passed, suppressed = self._sites.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                if suppressed:
+                    # Formatting happens on the listener thread, so extend the message
+                    record.msg = (
+                        f"{record.getMessage()} (+{suppressed} similar suppressed "
+                        f"in the last {now - started:.0f}s)"
+                    )
+                    record.args = None
+                started, passed, suppressed = now, 0, 0
+            if passed < self.burst:
+                self._sites[key] = (started, passed + 1, suppressed)
+                return True
+            self._sites[key] = (started, passed, suppressed + 1)
+            return False
+
+    def flush(self, force: bool = False) -> list:
+        """Return a summary record for every site whose burst ended with drops."""
+        now = time.monotonic()
+        summaries = []
+        with self._lock:
+            for key, (started, passed, suppressed) in list(self._sites.items()):
+                if not force and now - started < self.interval:
+                    continue
+                del self._sites[key]
+                if not suppressed:
+                    continue
+                name, lineno = key
+                summaries.append(
+                    logging.makeLogRecord(
+                        {
+                            "name": name,
+                            "levelno": logging.INFO,
+                            "levelname": logging.getLevelName(logging.INFO),
+                            "lineno": lineno,
+                            "msg": f"{suppressed} similar records from line {lineno} "
+                            f"suppressed in the last {now - started:.0f}s",
+                        }
+                    )
+                )
+        return summaries
+
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -23,10 +120,11 @@ LOGGING_CONFIG = {
             "datefmt": "%Y-%m-%d %H:%M:%S",
         },
     },
+    # Handlers pass everything, the logger levels decide and can change at runtime
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
-            "level": "INFO",
+            "level": "NOTSET",
             "formatter": "default",
         },
         "file": {
@@ -35,7 +133,7 @@ LOGGING_CONFIG = {
             "filename": os.path.join(APP_LOG_DIR, f"{log_time}.log"),
             "maxBytes": 10 * 1024 * 1024,
             "backupCount": 50,
-            "level": "INFO",
+            "level": "NOTSET",
         },
     },
     "root": {
@@ -62,7 +160,99 @@ LOGGING_CONFIG = {
 }
 
 
-def setup_logger():
-    """Setup the logger by creating the directories and configuring the logging system."""
+_listener = None
+_summaries = None
+
+
+def setup_logger(queue_mode: bool = LOG_QUEUE, json_format: bool = LOG_JSON):
+    """
+    Setup the logger by creating the directories and configuring the logging system.
+    In queue mode callers only enqueue their records, a listener thread formats them
+    and does the console and file I/O.
+    """
+    global _listener, _summaries
     make_log_dir()
-    logging.config.dictConfig(LOGGING_CONFIG)
+    config = copy.deepcopy(LOGGING_CONFIG)
+    if json_format:
+        config["formatters"]["default"] = {
+            "()": JsonFormatter,
+            "datefmt": config["formatters"]["default"]["datefmt"],
+        }
+    logging.config.dictConfig(config)
+    if not queue_mode:
+        return
+
+    _stop_listener()
+    loggers = [logging.getLogger()] + [
+        logging.getLogger(name) for name in config["loggers"]
+    ]
+    # The loggers share the console and file handlers, which move behind the queue
+    handlers = list(dict.fromkeys(h for lg in loggers for h in lg.handlers))
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    sampler = SummaryFilter()
+    queue_handler.addFilter(sampler)
+    for lg in loggers:
+        lg.handlers = [queue_handler]
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Report the drops of bursts that ended without another record from their site
+    stopped = threading.Event()
+    thread = threading.Thread(
+        target=_summary_loop,
+        args=(sampler, records, stopped),
+        name="log-summaries",
+        daemon=True,
+    )
+    thread.start()
+    _summaries = (sampler, records, stopped, thread)
+
+
+def _summary_loop(sampler: SummaryFilter, records: queue.SimpleQueue, stopped):
+    while not stopped.wait(sampler.interval):
+        for record in sampler.flush():
+            records.put(record)
+
+
+def _stop_listener():
+    """Drain the queue, with the pending summaries, before the process exits."""
+    global _listener, _summaries
+    if _summaries is not None:
+        sampler, records, stopped, thread = _summaries
+        stopped.set()
+        thread.join()
+        for record in sampler.flush(force=True):
+            records.put(record)
+        _summaries = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+_summaries = None
+
+
+atexit.register(_stop_listener)
+
+
+def _get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(None if name in ("", "root") else name)
+
+
+def set_log_levels(levels: dict) -> dict:
+    """Change the level of the given loggers, e.g. {"src.database": "WARNING"}."""
+    for name, level in levels.items():
+        _get_logger(name).setLevel(level.upper())
+    return get_log_levels(levels)
+
+
+def get_log_levels(names: list = None) -> dict:
+    """Report the effective level of the root, uvicorn and src loggers."""
+    if names is None:
+        names = ["", *LOGGING_CONFIG["loggers"]] + sorted(
+            name for name in logging.root.manager.loggerDict if name.startswith("src.")
+        )
+    return {
+        name or "root": logging.getLevelName(_get_logger(name).getEffectiveLevel())
+        for name in names
+    }
@@ -0,0 +1,325 @@
+import re
+import copy
+import time
+import random
+import hashlib
+import logging
+import threading
+from typing import Callable, Iterable, Iterator
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+    ALL_COMPLETED,
+)
+from .params import (
+    TABLE,
+    MATCHER_VERSION,
+    MATCHER_PREFILTER,
+    MATCHER_CHUNK_SIZE,
+    SCORE_BULK_SIZE,
+    SCORE_FLUSH_INTERVAL,
+    MATCHER_CONCURRENCY,
+    MATCHER_RATE_LIMIT,
+    MATCHER_MAX_RETRIES,
+    MATCHER_RETRY_BACKOFF,
+)
+
+from .utils import get_content_hash, get_curr_str_time
+from .prefilter import prefilter_resumes
+from .database import BulkUpserter
+from .metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+MATCH_SECONDS = histogram(
+    "matcher_evaluate_seconds", "Latency of one evaluate_match call", ("outcome",)
+)
+MATCH_CACHE_LOOKUPS = counter(
+    "match_cache_lookups_total", "evaluate_match cache lookups", ("result",)
+)
+
+
+# Fields evaluate_match reads, edits to any other field keep the existing score
+MATCH_RESUME_FIELDS = (
+    "information",
+    "expectation",
+    "education",
+    "certificate",
+    "language",
+    "skills",
+    "self_assessment",
+    "work_experience",
+    "project_experience",
+)
+MATCH_JOB_FIELDS = (
+    "title",
+    "city",
+    "salary",
+    "education",
+    "years_of_working",
+    "requirements",
+    "responsibilities",
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(value):
+    """Collapse whitespace in every string nested inside a field."""
+    if isinstance(value, str):
+        return _WHITESPACE.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _inputs_hash(doc: dict, fields: tuple) -> str:
+    return get_content_hash({f: _normalize(doc.get(f)) for f in fields}, exclude=())
+
+
+def get_match_fingerprint(resume: dict, job: dict) -> dict:
+    """Return the fields identifying the inputs a (resume, job) score was computed from."""
+    resume_hash = _inputs_hash(resume, MATCH_RESUME_FIELDS)
+    job_hash = _inputs_hash(job, MATCH_JOB_FIELDS)
+    fingerprint = hashlib.sha1(
+        f"{resume_hash}:{job_hash}:{MATCHER_VERSION}".encode("utf-8")
+    ).hexdigest()
+    return {
+        "resume_hash": resume_hash,
+        "job_hash": job_hash,
+        "matcher_version": MATCHER_VERSION,
+        "fingerprint": fingerprint,
+    }
+
+
+class MatchCancelled(Exception):
+    """Raised inside a worker once its job has been cancelled."""
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` calls per second."""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancel: threading.Event = None):
+        """Block until a call is allowed, or raise once `cancel` is set."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            if cancel is not None and cancel.wait(delay):
+                raise MatchCancelled()
+            if cancel is None:
+                time.sleep(delay)
+
+
+class MatcherEngine:
+    """
+    Score resumes against a job on a bounded thread pool with rate limiting and retries.
+    Pairs found in the optional MatchCache skip the limiter and the matcher entirely.
+    """
+
+    def __init__(
+        self,
+        matcher,
+        cache=None,
+        concurrency: int = MATCHER_CONCURRENCY,
+        rate: float = MATCHER_RATE_LIMIT,
+        max_retries: int = MATCHER_MAX_RETRIES,
+        backoff: float = MATCHER_RETRY_BACKOFF,
+    ):
+        self.matcher = matcher
+        self.cache = cache
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate) if rate else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _evaluate(self, resume: dict, job: dict, cancel: threading.Event) -> dict:
+        """Serve one pair from the cache, or evaluate it and cache the result."""
+        if self.cache is None:
+            return self._call(resume, job, cancel)
+        key = get_match_fingerprint(resume, job)["fingerprint"]
+        score = self.cache.get(key)
+        MATCH_CACHE_LOOKUPS.inc("miss" if score is None else "hit")
+        if score is None:
+            score = self._call(resume, job, cancel)
+            self.cache.set(key, copy.deepcopy(score))
+            return score
+        # Callers annotate the returned score, so never hand out the cached object
+        return copy.deepcopy(score)
+
+    def _call(self, resume: dict, job: dict, cancel: threading.Event) -> dict:
+        """Evaluate one pair, retrying transient failures with exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            if cancel.is_set():
+                raise MatchCancelled()
+            if self.limiter is not None:
+                self.limiter.acquire(cancel)
+            started = time.perf_counter()
+            try:
+                score = self.matcher.evaluate_match(resume, job)
+                MATCH_SECONDS.observe(time.perf_counter() - started, "ok")
+                return score
+            except Exception as e:
+                MATCH_SECONDS.observe(time.perf_counter() - started, "error")
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2**attempt * (1 + random.random())
+                logger.warning(
+                    f"Matching resume_id {resume.get('resume_id')} failed ({e}), retrying in {delay:.1f}s..."
+                )
+                if cancel.wait(delay):
+                    raise MatchCancelled()
+
+    def run(
+        self,
+        job: dict,
+        resumes: Iterable[dict],
+        on_result: Callable[[dict, dict], None],
+        cancel: threading.Event = None,
+    ) -> dict:
+        """
+        Score every resume against the job and pass each result to `on_result`.
+        Results are handed over in the calling thread, in completion order.
+        """
+        cancel = cancel or threading.Event()
+        stats = {"scored": 0, "failed": 0, "cancelled": False}
+        in_flight = {}
+
+        def drain(return_when):
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                resume = in_flight.pop(future)
+                try:
+                    score = future.result()
+                except MatchCancelled:
+                    continue
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.error(
+                        f"Failed to match resume_id {resume.get('resume_id')}: {e}"
+                    )
+                    continue
+                on_result(resume, score)
+                stats["scored"] += 1
+
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="matcher"
+        ) as executor:
+            for resume in resumes:
+                if cancel.is_set():
+                    break
+                # Keep the backlog bounded so that resumes are pulled lazily
+                if len(in_flight) >= 2 * self.concurrency:
+                    drain(FIRST_COMPLETED)
+                in_flight[executor.submit(self._evaluate, resume, job, cancel)] = resume
+            if in_flight:
+                drain(ALL_COMPLETED)
+
+        stats["cancelled"] = cancel.is_set()
+        return stats
+
+
+def _chunked(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def match_job(
+    mongo_db,
+    job: dict,
+    resumes: Iterable[dict],
+    matcher,
+    cancel: threading.Event = None,
+    cache=None,
+) -> dict:
+    """Score the new or changed resumes of a stream against a job and upsert the scores."""
+    job_id = job["_id"]
+    counts = {"unchanged": 0, "filtered": 0}
+    fingerprints = {}
+
+    def pending_resumes():
+        # Only pairs without a score, or whose inputs changed since, are evaluated
+        for chunk in _chunked(resumes, MATCHER_CHUNK_SIZE):
+            scored = {
+                score["resume_id"]: score.get("fingerprint")
+                for score in mongo_db.select_data(
+                    TABLE.SCORE.value,
+                    {
+                        "job_id": job_id,
+                        "resume_id": {"$in": [r["resume_id"] for r in chunk]},
+                    },
+                    {"resume_id": 1, "fingerprint": 1},
+                )
+                or []
+            }
+            changed = []
+            for resume in chunk:
+                fingerprint = get_match_fingerprint(resume, job)
+                if scored.get(resume["resume_id"]) == fingerprint["fingerprint"]:
+                    counts["unchanged"] += 1
+                else:
+                    fingerprints[resume["resume_id"]] = fingerprint
+                    changed.append(resume)
+            survivors = (
+                prefilter_resumes(changed, job) if MATCHER_PREFILTER else changed
+            )
+            counts["filtered"] += len(changed) - len(survivors)
+            yield from survivors
+
+    def save_score(resume: dict, score: dict):
+        score.update(fingerprints.pop(resume["resume_id"]))
+        score["job_id"] = job_id
+        score["resume_id"] = resume["resume_id"]
+        score["answers"] = []
+        score["final_score"] = -1
+        score["status"] = "evaluated"
+        score["updated_at"] = get_curr_str_time()
+        writer.add(score)
+        logger.info(
+            f"Finish match for job_id {job_id} and resume_id {resume['resume_id']}, initial score is {score['initial_score']:>4.1f}.",
+            extra={"sample": True},
+        )
+
+    logger.info(f"Start matching for job_id {job_id}...")
+    # Scores are written behind in bulk, the buffer is flushed on exit or cancellation
+    with BulkUpserter(
+        mongo_db,
+        TABLE.SCORE.value,
+        keys=("job_id", "resume_id"),
+        batch_size=SCORE_BULK_SIZE,
+        flush_interval=SCORE_FLUSH_INTERVAL,
+        background=True,
+    ) as writer:
+        stats = MatcherEngine(matcher, cache).run(
+            job, pending_resumes(), save_score, cancel
+        )
+    stats.update(counts)
+    logger.info(
+        f"Matching for job_id {job_id} {'cancelled' if stats['cancelled'] else 'finished'}: "
+        f"{stats['scored']} scored, {stats['failed']} failed, "
+        f"{stats['unchanged']} unchanged, {stats['filtered']} filtered out."
+    )
+    return stats
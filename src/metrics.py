@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from redis import Redis
+from .params import (
+    METRICS_KEY,
+    METRICS_FLUSH_INTERVAL,
+    METRICS_BUCKETS,
+    SCRAPER_PENDING_TASKS_KEY,
+    SCRAPER_PROCESSING_TASKS_KEY,
+    SCRAPER_RUNNING_TASKS_KEY,
+    MESSAGE_STREAM_KEY,
+    MESSAGE_GROUP,
+)
+
+logger = logging.getLogger(__name__)
+
+# Every thread records into its own shard, so the hot path takes no lock. The flusher
+# copies the shards and pushes the deltas since its last flush to Redis. Shards of
+# threads that exited are folded into `_retired`, so short-lived pools do not pile up.
+_local = threading.local()
+_shards = []
+_retired = defaultdict(float)
+_flushed = {}
+_flusher = None
+_shards_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+REGISTRY = {}
+
+
+def _shard() -> defaultdict:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = defaultdict(float)
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+        _start_flusher()
+    return shard
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        REGISTRY[name] = self
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1):
+        _shard()[(self.name, label_values, "")] += amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: tuple = METRICS_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values: str):
+        shard = _shard()
+        index = bisect.bisect_left(self.buckets, value)
+        shard[(self.name, label_values, index)] += 1
+        shard[(self.name, label_values, "sum")] += value
+
+    @contextmanager
+    def time(self, *label_values: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+
+def counter(name: str, documentation: str, labels: tuple = ()) -> Counter:
+    return REGISTRY.get(name) or Counter(name, documentation, labels)
+
+
+def histogram(
+    name: str, documentation: str, labels: tuple = (), buckets: tuple = METRICS_BUCKETS
+) -> Histogram:
+    return REGISTRY.get(name) or Histogram(name, documentation, labels, buckets)
+
+
+def flush(redis: Redis = None):
+    """Add what this process recorded since the last flush to the shared hash."""
+    with _flush_lock:
+        _flush(redis)
+
+
+def _flush(redis: Redis = None):
+    with _shards_lock:
+        live = []
+        for thread, shard in _shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            # A finished thread no longer writes to its shard
+            for key, value in shard.items():
+                _retired[key] += value
+        _shards[:] = live
+        totals = defaultdict(float, _retired)
+    for _, shard in live:
+        # Copying a dict is atomic under the GIL, writers never wait for it
+        for key, value in shard.copy().items():
+            totals[key] += value
+
+    pipe = None
+    for key, value in totals.items():
+        delta = value - _flushed.get(key, 0)
+        if not delta:
+            continue
+        if pipe is None:
+            if redis is None:
+                from .connection import get_redis
+
+                redis = get_redis()
+            pipe = redis.pipeline(transaction=False)
+        name, label_values, suffix = key
+        pipe.hincrbyfloat(
+            METRICS_KEY, json.dumps([name, list(label_values), suffix]), delta
+        )
+        _flushed[key] = value
+    if pipe is not None:
+        pipe.execute()
+
+
+def flush_quietly(redis: Redis = None):
+    """
+    Flush, logging instead of raising. RQ work-horses leave through os._exit, which
+    skips atexit, so jobs call this themselves before they return.
+    """
+    try:
+        flush(redis)
+    except Exception as e:
+        logger.error(f"Failed to flush metrics: {e}")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush_quietly()
+
+
+def _start_flusher():
+    global _flusher
+    # Import the connection module now, importing it during interpreter shutdown
+    # fails once atexit no longer accepts new hooks
+    from . import connection  # noqa: F401
+
+    with _shards_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_loop, name="metrics-flusher", daemon=True
+            )
+            _flusher.start()
+
+
+def _reset_after_fork():
+    """The parent flushes what it recorded, a forked child starts from zero."""
+    global _local, _flusher, _shards_lock, _flush_lock
+    _local = threading.local()
+    _shards.clear()
+    _retired.clear()
+    _flushed.clear()
+    _flusher = None
+    _shards_lock = threading.Lock()
+    _flush_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(lambda: _flusher is not None and flush_quietly())
+
+
+def _format_labels(names: tuple, values: list, extra: str = None) -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def queue_gauges(redis: Redis, queues: list = []) -> dict:
+    """Read the current depth of the scraper, RQ and message queues."""
+    pipe = redis.pipeline(transaction=False)
+    pipe.llen(SCRAPER_PENDING_TASKS_KEY)
+    pipe.llen(SCRAPER_PROCESSING_TASKS_KEY)
+    pipe.get(SCRAPER_RUNNING_TASKS_KEY)
+    pipe.xlen(MESSAGE_STREAM_KEY)
+    pending, processing, running, stream = pipe.execute()
+    gauges = {
+        "scraper_pending_tasks": ("Scraper tasks waiting for a slot", pending),
+        "scraper_processing_tasks": ("Scraper tasks holding a slot", processing),
+        "scraper_running_tasks": ("Scraper slots in use", int(running or 0)),
+        "message_stream_length": ("Entries kept in the message stream", stream),
+    }
+    try:
+        unacked = redis.xpending(MESSAGE_STREAM_KEY, MESSAGE_GROUP)["pending"]
+    except Exception:
+        unacked = 0
+    gauges["message_pending_entries"] = ("Messages delivered but not acked", unacked)
+    for queue in queues:
+        gauges[f"rq_{queue.name}_jobs"] = (f"Jobs queued on {queue.name}", queue.count)
+    return gauges
+
+
+def render(redis: Redis, gauges: dict = {}) -> str:
+    """Render the metrics of every process in the Prometheus text format."""
+    series = defaultdict(dict)
+    for field, value in redis.hgetall(METRICS_KEY).items():
+        name, label_values, suffix = json.loads(field)
+        series[name][(tuple(label_values), suffix)] = float(value)
+
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        samples = series.get(name, {})
+        if metric.kind == "counter":
+            for (label_values, _), value in sorted(samples.items()):
+                lines.append(
+                    f"{name}{_format_labels(metric.labels, label_values)} {value}"
+                )
+            continue
+
+        for label_values in sorted({values for values, _ in samples}):
+            cumulative = 0
+            for index, bound in enumerate((*metric.buckets, "+Inf")):
+                cumulative += samples.get((label_values, index), 0)
+                labels = _format_labels(metric.labels, label_values, f'le="{bound}"')
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            labels = _format_labels(metric.labels, label_values)
+            lines.append(f"{name}_sum{labels} {samples.get((label_values, 'sum'), 0)}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+
+    for name, (documentation, value) in gauges.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,125 @@
+import os
+import re
+import sys
+import time
+import logging
+import threading
+import subprocess
+from .params import (
+    MODEL_DIR,
+    MODEL_PREWARM,
+    DEBUG_IMPORTTIME_TOP,
+    DEBUG_IMPORTTIME_ENV,
+)
+
+logger = logging.getLogger(__name__)
+
+# Models of the current process, loaded on first use and reloaded after a fork
+_models = {}
+_models_pid = None
+_models_lock = threading.Lock()
+# One lock per model, so loading one never holds up callers of another
+_model_locks = {}
+_load_times = {}
+
+
+def _load_matcher():
+    from match.job_resume_match import ResumeJobMatcher
+
+    return ResumeJobMatcher()
+
+
+def _load_chat():
+    from AIChat.AIChat import SendInvitation, GetResponse
+
+    return GetResponse, SendInvitation
+
+
+_LOADERS = {"matcher": _load_matcher, "chat": _load_chat}
+
+
+def get_model(name: str):
+    """Return the process-wide instance of a model, loading it on first use."""
+    global _models_pid
+    with _models_lock:
+        if _models_pid != os.getpid():
+            _models.clear()
+            _model_locks.clear()
+            _models_pid = os.getpid()
+        if name in _models:
+            return _models[name]
+        lock = _model_locks.setdefault(name, threading.Lock())
+
+    with lock:
+        if name in _models:
+            return _models[name]
+        if MODEL_DIR not in sys.path:
+            sys.path.append(MODEL_DIR)
+        started = time.perf_counter()
+        model = _LOADERS[name]()
+        _load_times[name] = round(time.perf_counter() - started, 4)
+        logger.info(f"Loaded model {name} in {_load_times[name]}s")
+        with _models_lock:
+            _models[name] = model
+        return model
+
+
+def get_matcher():
+    """The shared ResumeJobMatcher, its evaluate_match is called from many threads."""
+    return get_model("matcher")
+
+
+def get_chat_functions() -> tuple:
+    """The chat model's (GetResponse, SendInvitation)."""
+    return get_model("chat")
+
+
+def prewarm(names: tuple = MODEL_PREWARM):
+    """Load the given models now so the first request does not pay for it."""
+    for name in names:
+        try:
+            get_model(name)
+        except Exception as e:
+            logger.error(f"Failed to prewarm model {name}: {e}")
+
+
+def model_load_times() -> dict:
+    return dict(_load_times)
+
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_time_report(module: str = "main", top: int = DEBUG_IMPORTTIME_TOP) -> dict:
+    """
+    Import `module` in a fresh interpreter under `-X importtime` and return the total
+    and the slowest imports by cumulative time, in microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.getcwd(),
+        env={**os.environ, DEBUG_IMPORTTIME_ENV: "1"},
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append(
+                {
+                    "module": name,
+                    "self_us": int(self_us),
+                    "cumulative_us": int(cumulative_us),
+                    "depth": len(indent) // 2,
+                }
+            )
+    total = sum(entry["self_us"] for entry in imports)
+    imports.sort(key=lambda entry: entry["cumulative_us"], reverse=True)
+    return {
+        "module": module,
+        "returncode": result.returncode,
+        "total_us": total,
+        "imports": imports[:top],
+    }
@@ -16,6 +16,32 @@ MONGO_POST: Final = 27017
 
 DB_NAME: Final = "CV_RESUME"
 
+# Connection pools, created once per process by src/connection.py
+MONGO_MIN_POOL_SIZE: Final = 2
+MONGO_MAX_POOL_SIZE: Final = 50
+MONGO_WAIT_QUEUE_TIMEOUT_MS: Final = 5000
+MONGO_CONNECT_TIMEOUT_MS: Final = 5000
+MONGO_SERVER_SELECTION_TIMEOUT_MS: Final = 5000
+REDIS_MAX_CONNECTIONS: Final = 50
+REDIS_POOL_TIMEOUT: Final = 5
+REDIS_CONNECT_TIMEOUT: Final = 5
+REDIS_HEALTH_CHECK_INTERVAL: Final = 30
+# Separate pool for pubsub and blocking reads, which hold a connection for good
+REDIS_SUBSCRIBER_MAX_CONNECTIONS: Final = 500
+
+# Location of the matcher and chat models
+MODEL_DIR: Final = "/home/resume"
+# Models loaded by the API lifespan before it starts serving
+MODEL_PREWARM: Final = ("matcher", "chat")
+
+# Streaming reads fetch pages of CURSOR_PAGE_SIZE documents by `_id`
+CURSOR_BATCH_SIZE: Final = 500
+CURSOR_PAGE_SIZE: Final = 5000
+
+# Bulk writes are flushed once either limit is reached
+BULK_BATCH_SIZE: Final = 500
+BULK_FLUSH_INTERVAL: Final = 2.0
+
 
 class TABLE(Enum):
     RESUME = "resume"
@@ -23,6 +49,18 @@ class TABLE(Enum):
     SCORE = "score"
     CHAT = "chat"
     TASK = "task"
+    RESUME_TERMS = "resume_terms"
+
+
+# Point lookups on these fields are served from the document cache
+DOC_CACHE_KEYS: Final = {
+    TABLE.JOB.value: "_id",
+    TABLE.RESUME.value: "resume_id",
+    TABLE.TASK.value: "task_id",
+}
+DOC_CACHE_SIZE: Final = 1000
+DOC_CACHE_TTL: Final = 60
+DOC_CACHE_CHANNEL: Final = "doc_cache_invalidate"
 
 
 ###########################################################
@@ -30,6 +68,74 @@ class TABLE(Enum):
 ###########################################################
 RQ_LOG_DIR: Final = "logs/rq"
 APP_LOG_DIR: Final = "logs/app"
+# Log records are written by a listener thread, repeated ones are sampled
+LOG_QUEUE: Final = True
+LOG_JSON: Final = False
+LOG_SAMPLE_BURST: Final = 20
+LOG_SAMPLE_INTERVAL: Final = 10
+DEBUG_IMPORTTIME_TOP: Final = 30
+# Set in the process that imports main only to profile it, skips logging setup
+DEBUG_IMPORTTIME_ENV: Final = "APP_IMPORTTIME_PROFILE"
+
+# Metrics of every process are summed in one Redis hash, flushed periodically
+METRICS_KEY: Final = "metrics"
+METRICS_FLUSH_INTERVAL: Final = 5
+METRICS_BUCKETS: Final = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+
+DASHBOARD_PAGE_SIZE: Final = 50
+DASHBOARD_MAX_LIMIT: Final = 200
+DASHBOARD_CACHE_SIZE: Final = 256
+DASHBOARD_CACHE_TTL: Final = 30
+DASHBOARD_VERSION_KEY: Final = "dashboard_version"
+
+
+###########################################################
+#                       Matcher                           #
+###########################################################
+# Bump whenever the matcher or its prompts change so that every pair is re-scored
+MATCHER_VERSION: Final = "1"
+# Drop resumes that violate a job's hard constraints before evaluate_match
+MATCHER_PREFILTER: Final = True
+# BM25 parameters of the resume index used for top-K shortlisting
+INDEX_BM25_K1: Final = 1.5
+INDEX_BM25_B: Final = 0.75
+# Refreshes re-read this many seconds before the newest loaded document, covering
+# write latency and clock skew between the writing processes
+INDEX_REFRESH_OVERLAP: Final = 60
+# evaluate_match results are cached in process and in Redis
+MATCH_CACHE_KEY: Final = "match_cache"
+MATCH_CACHE_SIZE: Final = 10000
+MATCH_CACHE_TTL: Final = 7 * 24 * 60 * 60
+MATCH_CACHE_REDIS_MAX_ENTRIES: Final = 200000
+# Resumes are streamed through fingerprint checks and the pre-filter in chunks
+MATCHER_CHUNK_SIZE: Final = 500
+# Scores are upserted on (job_id, resume_id) in bulk, flushed by count or interval
+SCORE_BULK_SIZE: Final = 100
+SCORE_FLUSH_INTERVAL: Final = 5.0
+# Largest page of ranked candidates returned at once
+LEADERBOARD_MAX_LIMIT: Final = 200
+# Number of pairs evaluated concurrently
+MATCHER_CONCURRENCY: Final = 8
+# Upper bound on evaluate_match calls per second, 0 disables the limit
+MATCHER_RATE_LIMIT: Final = 5.0
+# Transient failures are retried with exponential backoff
+MATCHER_MAX_RETRIES: Final = 3
+MATCHER_RETRY_BACKOFF: Final = 1.0
+
+
+# Batch matching fans (job, resume shard) pairs out to RQ workers
+MATCHER_QUEUE_KEY: Final = "matcher_queue"
+MATCHER_BATCH_KEY: Final = "matcher_batch"
+MATCHER_BATCH_TTL: Final = 7 * 24 * 60 * 60
+MATCHER_SHARD_SIZE: Final = 1000
+MATCHER_SHARD_RETRIES: Final = 3
+MATCHER_SHARD_TIMEOUT: Final = 6 * 60 * 60
+# Seconds between checks for cancelled batches and for shards of dead workers
+MATCHER_CANCEL_POLL: Final = 5
+MATCHER_REAP_INTERVAL: Final = 60
+# Warm matcher workers run `python -m src.pool matcher`, recycled like the scraper's
+MATCHER_POOL_SIZE: Final = 2
+MATCHER_WORKER_MAX_TASKS: Final = 200
 
 
 ###########################################################
@@ -39,17 +145,71 @@ APP_LOG_DIR: Final = "logs/app"
 SCRAPER_QUEUE_KEY: Final = "scraper_queue"
 SCRAPER_RUNNING_TASKS_KEY: Final = "running_scrapers"
 SCRAPER_PENDING_TASKS_KEY: Final = "pending_scrapers"
+SCRAPER_PROCESSING_TASKS_KEY: Final = "processing_scrapers"
+SCRAPER_PENDING_SINCE_KEY: Final = "pending_scrapers_since"
+SCRAPER_EVENTS_CHANNEL: Final = "scraper_events"
+SCRAPER_FILTER_KEY: Final = "scraper_filter"
+SCRAPER_PROGRESS_KEY: Final = "scraper_progress"
 
 # Scraper parameters
 MAX_RUNNING_TASKS: Final = 3
+# Upper bound on how long the scheduler sleeps without any event
+SCRAPER_SCHEDULER_TIMEOUT: Final = 30
+# How often tasks of dead scraper workers are failed and their slots released
+SCRAPER_REAP_INTERVAL: Final = 60
+# Identical filters attach to an in-flight task, or reuse a finished one within the TTL
+SCRAPER_INFLIGHT_TTL: Final = 6 * 60 * 60
+SCRAPER_RESULT_TTL: Final = 10 * 60
+
+# Progress counters are pushed at most once per interval, state changes at once
+SCRAPER_PROGRESS_INTERVAL: Final = 0.5
+SCRAPER_PROGRESS_TTL: Final = 24 * 60 * 60
+SCRAPER_STREAM_KEEPALIVE: Final = 15
+# Progress streams open at once per API process, each holds a subscriber connection
+SCRAPER_STREAM_MAX_SUBSCRIBERS: Final = 200
+SCRAPER_READ_CHUNK_SIZE: Final = 64 * 1024
+
+# Warm worker pool, sized independently of MAX_RUNNING_TASKS
+SCRAPER_POOL_SIZE: Final = 4
+# Recycle a worker after it has served this many tasks
+SCRAPER_WORKER_MAX_TASKS: Final = 50
+# A crashed worker is restarted after an exponential backoff, the pool gives up
+# once one slot crashed this many times in a row
+SCRAPER_RESTART_BACKOFF: Final = 1
+SCRAPER_RESTART_BACKOFF_MAX: Final = 60
+SCRAPER_CRASH_LIMIT: Final = 5
 
 # Paths for scraper scripts and logs
 SCRAPER_DIR: Final = "scraper"
+SCRAPER_ENTRY: Final = "main.py"
 SCRAPER_LOG_DIR: Final = "logs/scraper"
 
 
 ###########################################################
 #                     Message Relay                       #
 ###########################################################
-# Redis keys for tracking messages
-MESSAGE_QUEUE_KEY: Final = "message_queue"
+# Incoming messages are a Redis stream read by a consumer group
+MESSAGE_STREAM_KEY: Final = "message_stream"
+MESSAGE_STREAM_MAXLEN: Final = 100000
+MESSAGE_GROUP: Final = "message_relay"
+MESSAGE_BATCH_SIZE: Final = 32
+MESSAGE_BLOCK_MS: Final = 5000
+MESSAGE_CONCURRENCY: Final = 16
+# A handler running longer is cancelled and its entry retried later
+MESSAGE_HANDLE_TIMEOUT: Final = 300
+# Entries left unacknowledged this long by a consumer are claimed by another one. A
+# live consumer resets the idle time of its in-flight entries every claim interval
+MESSAGE_CLAIM_IDLE_MS: Final = (MESSAGE_HANDLE_TIMEOUT + 60) * 1000
+MESSAGE_CLAIM_INTERVAL: Final = 30
+# Entries delivered this many times are moved to the dead-letter stream
+MESSAGE_MAX_DELIVERIES: Final = 5
+MESSAGE_DEAD_LETTER_KEY: Final = "message_dead_letter"
+
+# Chat history is stored in buckets of at most CHAT_BUCKET_SIZE messages
+CHAT_BUCKET_SIZE: Final = 100
+CHAT_HISTORY_LIMIT: Final = 20
+CHAT_APPEND_RETRIES: Final = 3
+
+# Blocking chat model calls run on a bounded thread pool
+RESPONDER_MAX_WORKERS: Final = 8
+RESPONDER_MAX_PENDING: Final = 64
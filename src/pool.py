@@ -0,0 +1,203 @@
+import io
+import os
+import sys
+import time
+import runpy
+import logging
+import threading
+import contextlib
+import multiprocessing
+from multiprocessing.connection import wait
+from rq import Queue, SimpleWorker
+from .params import (
+    SCRAPER_DIR,
+    SCRAPER_ENTRY,
+    SCRAPER_QUEUE_KEY,
+    SCRAPER_POOL_SIZE,
+    SCRAPER_WORKER_MAX_TASKS,
+    MATCHER_QUEUE_KEY,
+    MATCHER_POOL_SIZE,
+    MATCHER_WORKER_MAX_TASKS,
+    SCRAPER_RESTART_BACKOFF,
+    SCRAPER_RESTART_BACKOFF_MAX,
+    SCRAPER_CRASH_LIMIT,
+)
+from .connection import get_redis
+from .models import get_matcher
+
+logger = logging.getLogger(__name__)
+
+_scraper_dir = os.path.abspath(SCRAPER_DIR)
+_warm = False
+
+
+def is_warm() -> bool:
+    """Whether this process has already imported the scraper package."""
+    return _warm
+
+
+def warm_up():
+    """Import the scraper entry script once so later tasks skip the startup cost."""
+    global _warm
+    if _scraper_dir not in sys.path:
+        sys.path.insert(0, _scraper_dir)
+    with contextlib.chdir(_scraper_dir):
+        # Executes the module body without its `__main__` block
+        runpy.run_path(SCRAPER_ENTRY, run_name="scraper_warmup")
+    _warm = True
+    logger.info(f"Scraper worker {os.getpid()} warmed up.")
+
+
+class InProcessScraper:
+    """Run the scraper entry script inside this warm process with a Popen-like interface."""
+
+    def __init__(self, param_input: str, stderr):
+        self.args = [SCRAPER_ENTRY, param_input]
+        self.returncode = None
+        read_fd, write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, "rb")
+        self._stdout_w = os.fdopen(write_fd, "w", encoding="utf-8")
+        self._stderr_w = io.TextIOWrapper(stderr, encoding="utf-8", write_through=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        argv = sys.argv
+        try:
+            with contextlib.ExitStack() as stack:
+                stack.enter_context(contextlib.redirect_stdout(self._stdout_w))
+                stack.enter_context(contextlib.redirect_stderr(self._stderr_w))
+                stack.enter_context(contextlib.chdir(_scraper_dir))
+                sys.argv = list(self.args)
+                runpy.run_path(SCRAPER_ENTRY, run_name="__main__")
+            self.returncode = 0
+        except SystemExit as e:
+            code = e.code
+            self.returncode = code if isinstance(code, int) else int(code is not None)
+        except BaseException as e:
+            self._stderr_w.write(f"{type(e).__name__}: {e}\n")
+            self.returncode = 1
+        finally:
+            sys.argv = argv
+            self._stderr_w.detach()
+            try:
+                self._stdout_w.close()
+            except BrokenPipeError:
+                pass
+
+    def wait(self) -> int:
+        """Wait for the scraper to finish and return its exit code."""
+        self._thread.join()
+        return self.returncode
+
+
+def _warm_matcher():
+    """Load the matcher once, instead of in the work-horse `rq worker` forks per job."""
+    get_matcher()
+    logger.info(f"Matcher worker {os.getpid()} warmed up.")
+
+
+# Queue, size, jobs served before recycling and warm-up of every pool
+POOLS = {
+    "scraper": (
+        SCRAPER_QUEUE_KEY,
+        SCRAPER_POOL_SIZE,
+        SCRAPER_WORKER_MAX_TASKS,
+        warm_up,
+    ),
+    "matcher": (
+        MATCHER_QUEUE_KEY,
+        MATCHER_POOL_SIZE,
+        MATCHER_WORKER_MAX_TASKS,
+        _warm_matcher,
+    ),
+}
+
+
+def _worker_main(name: str):
+    """Warm up, then serve the pool's jobs until the recycle limit is reached."""
+    queue_key, _, max_tasks, warm = POOLS[name]
+    try:
+        warm()
+    except (Exception, SystemExit) as e:
+        # The entry script may also exit while parsing argv at import time
+        logger.exception(
+            f"{name.capitalize()} worker {os.getpid()} failed to warm up: {e!r}"
+        )
+        sys.exit(1)
+    redis = get_redis(decode_responses=False)
+    queue = Queue(queue_key, connection=redis)
+    # SimpleWorker runs jobs in this process, so the warm imports are reused
+    worker = SimpleWorker([queue], connection=redis)
+    worker.work(max_jobs=max_tasks)
+
+
+def run_pool(name: str = "scraper", size: int = None):
+    """
+    Keep `size` warm workers of a pool alive, replacing each one once it retires. A
+    worker that crashed is restarted after a growing delay, and the pool stops once a
+    slot hits SCRAPER_CRASH_LIMIT crashes in a row.
+    """
+    size = size or POOLS[name][1]
+    workers, crashes, restart_at = {}, {}, {}
+    try:
+        while True:
+            now = time.monotonic()
+            for slot in range(size):
+                process = workers.get(slot)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    del workers[slot]
+                    if process.exitcode == 0:
+                        crashes[slot] = 0
+                        logger.info(
+                            f"{name.capitalize()} worker {process.pid} retired, recycling..."
+                        )
+                    else:
+                        crashes[slot] = crashes.get(slot, 0) + 1
+                        if crashes[slot] >= SCRAPER_CRASH_LIMIT:
+                            raise RuntimeError(
+                                f"{name.capitalize()} worker slot {slot} crashed {crashes[slot]} "
+                                f"times in a row, last exit code {process.exitcode}"
+                            )
+                        delay = min(
+                            SCRAPER_RESTART_BACKOFF * 2 ** (crashes[slot] - 1),
+                            SCRAPER_RESTART_BACKOFF_MAX,
+                        )
+                        restart_at[slot] = now + delay
+                        logger.error(
+                            f"{name.capitalize()} worker {process.pid} exited with "
+                            f"{process.exitcode}, restarting in {delay}s..."
+                        )
+                if restart_at.get(slot, 0) > now:
+                    continue
+                process = multiprocessing.Process(
+                    target=_worker_main, args=(name,), name=f"{name}-worker-{slot}"
+                )
+                process.start()
+                workers[slot] = process
+                logger.info(
+                    f"{name.capitalize()} worker {process.pid} started in slot {slot}"
+                )
+
+            # Block until any worker exits or a delayed restart is due
+            delays = [
+                at - now for slot, at in restart_at.items() if slot not in workers
+            ]
+            wait(
+                [process.sentinel for process in workers.values()],
+                timeout=max(0, min(delays)) if delays else None,
+            )
+    finally:
+        for process in workers.values():
+            process.terminate()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    run_pool(sys.argv[1] if len(sys.argv) > 1 else "scraper")
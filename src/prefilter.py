@@ -0,0 +1,159 @@
+import re
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cities recognised in resume expectations, one boolean column each
+# fmt: off
+CITIES = (
+    "北京", "上海", "广州", "深圳", "杭州", "南京", "苏州", "成都", "重庆", "武汉",
+    "西安", "天津", "长沙", "郑州", "青岛", "济南", "合肥", "厦门", "福州", "宁波",
+    "无锡", "东莞", "佛山", "珠海", "沈阳", "大连", "哈尔滨", "长春", "石家庄", "太原",
+    "昆明", "贵阳", "南宁", "南昌", "海口", "兰州", "乌鲁木齐", "呼和浩特", "银川", "西宁",
+    "拉萨", "常州", "南通", "温州", "嘉兴", "绍兴", "金华", "台州", "烟台", "潍坊",
+    "徐州", "惠州", "中山", "香港", "澳门", "台北",
+)
+# fmt: on
+
+# Ordered from highest to lowest so that the first hit wins
+DEGREE_LEVELS = (
+    ("博士", 5),
+    ("硕士", 4),
+    ("研究生", 4),
+    ("本科", 3),
+    ("大专", 2),
+    ("专科", 2),
+    ("中专", 1),
+    ("高中", 1),
+)
+
+_DEGREE_MIN = re.compile(
+    "(" + "|".join(name for name, _ in DEGREE_LEVELS) + r")\s*(?:学历)?\s*及?以上"
+)
+_SALARY = re.compile(r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)\s*([kK千万])")
+_EXPERIENCE = re.compile(r"工作\s*(\d+)\s*年")
+_YEARS_RANGE = re.compile(r"(\d+)\s*-\s*(\d+)\s*年")
+_YEARS_MIN = re.compile(r"(\d+)\s*年以上")
+
+# Longer stated experience is taken for a typo and treated as unknown
+MAX_EXPERIENCE_YEARS = 60
+
+
+def parse_degree(text: str) -> int:
+    """Return the highest degree level mentioned in the text, 0 if none."""
+    for name, level in DEGREE_LEVELS:
+        if name in text:
+            return level
+    return 0
+
+
+def parse_required_degree(text: str) -> int:
+    """
+    Return the minimum degree level a job requires, 0 if none. "本科及以上，硕士优先"
+    requires 本科, so the level marked 以上 wins, otherwise the lowest one mentioned.
+    """
+    if match := _DEGREE_MIN.search(text):
+        return dict(DEGREE_LEVELS)[match.group(1)]
+    return min((level for name, level in DEGREE_LEVELS if name in text), default=0)
+
+
+def parse_salary(text: str) -> tuple:
+    """Return the first monthly salary range in the text in thousands, or None."""
+    match = _SALARY.search(text)
+    if match is None:
+        return None
+    unit = 10 if match.group(3) == "万" else 1
+    return float(match.group(1)) * unit, float(match.group(2)) * unit
+
+
+def parse_experience(text: str) -> int:
+    """Return the years of working stated in a resume summary, -1 if unknown."""
+    if "应届" in text or "在校" in text or "1年以下" in text:
+        return 0
+    match = _EXPERIENCE.search(text)
+    if match is None or int(match.group(1)) > MAX_EXPERIENCE_YEARS:
+        return -1
+    return int(match.group(1))
+
+
+def parse_years_range(text: str) -> tuple:
+    """Return the (min, max) years of working a job requires, or None if unrestricted."""
+    if not text or "不限" in text:
+        return None
+    if "应届" in text or "在校" in text:
+        return 0, 0
+    if "1年以下" in text:
+        return 0, 1
+    if match := _YEARS_RANGE.search(text):
+        return int(match.group(1)), int(match.group(2))
+    if match := _YEARS_MIN.search(text):
+        return int(match.group(1)), 127
+    return None
+
+
+class ResumePool:
+    """
+    Columnar view of the resume fields that carry hard constraints.
+
+    Unknown values never rule a resume out, so the filter only drops candidates that
+    are provably incompatible with the job.
+    """
+
+    def __init__(self, resumes: list, cities: tuple = CITIES):
+        n = len(resumes)
+        self.cities = {city: i for i, city in enumerate(cities)}
+        self.city = np.zeros((n, len(cities)), dtype=bool)
+        self.degree = np.zeros(n, dtype=np.int8)
+        self.experience = np.full(n, -1, dtype=np.int16)
+        self.salary_low = np.full(n, np.nan, dtype=np.float32)
+
+        for i, resume in enumerate(resumes):
+            expectation = " ".join(resume.get("expectation") or [])
+            for city, j in self.cities.items():
+                if city in expectation:
+                    self.city[i, j] = True
+            if salary := parse_salary(expectation):
+                self.salary_low[i] = salary[0]
+
+            information = resume.get("information") or ""
+            self.degree[i] = max(
+                parse_degree(" ".join(resume.get("education") or [])),
+                parse_degree(information),
+            )
+            self.experience[i] = parse_experience(information)
+
+    def __len__(self) -> int:
+        return len(self.degree)
+
+    def match(self, job: dict) -> np.ndarray:
+        """Return a boolean mask of the resumes compatible with the job's hard constraints."""
+        mask = np.ones(len(self), dtype=bool)
+
+        city = re.split(r"[-·\s]", job.get("city") or "", maxsplit=1)[0]
+        if city in self.cities:
+            has_city = self.city.any(axis=1)
+            mask &= ~has_city | self.city[:, self.cities[city]]
+
+        if degree := parse_required_degree(job.get("education") or ""):
+            mask &= (self.degree == 0) | (self.degree >= degree)
+
+        if years := parse_years_range(job.get("years_of_working") or ""):
+            known = self.experience >= 0
+            mask &= ~known | (
+                (self.experience >= years[0]) & (self.experience <= years[1])
+            )
+
+        if salary := parse_salary(job.get("salary") or ""):
+            mask &= np.isnan(self.salary_low) | (self.salary_low <= salary[1])
+
+        return mask
+
+
+def prefilter_resumes(resumes: list, job: dict) -> list:
+    """Return the resumes that satisfy the job's hard constraints."""
+    if not resumes:
+        return resumes
+    mask = ResumePool(resumes).match(job)
+    logger.debug(f"Pre-filter kept {int(mask.sum())} of {len(resumes)} resumes.")
+    return [resume for resume, keep in zip(resumes, mask) if keep]
@@ -0,0 +1,131 @@
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from .params import (
+    SCRAPER_PROGRESS_KEY,
+    SCRAPER_PROGRESS_TTL,
+    SCRAPER_PROGRESS_INTERVAL,
+    SCRAPER_STREAM_KEEPALIVE,
+)
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = {"Finished", "FormatError", "ProcessError", "UnknownError"}
+
+
+def _progress_key(task_id: str) -> str:
+    return f"{SCRAPER_PROGRESS_KEY}:{task_id}"
+
+
+class ProgressReporter:
+    """Publish a scraper task's state transitions and live counters over Redis."""
+
+    def __init__(
+        self, redis: Redis, task_id: str, interval: float = SCRAPER_PROGRESS_INTERVAL
+    ):
+        self.redis = redis
+        self.task_id = task_id
+        self.interval = interval
+        self.snapshot = {
+            "task_id": task_id,
+            "status": "Pending",
+            "detail": None,
+            "parsed": 0,
+            "inserted": 0,
+            "updated": 0,
+            "skipped": 0,
+            "bytes": 0,
+        }
+        self._last_publish = 0.0
+
+    def update(self, status: str = None, detail: str = None, **counters):
+        """Update the snapshot, publishing state changes at once and counters throttled."""
+        self.snapshot.update(counters)
+        if status is not None:
+            self.snapshot["status"] = status
+            self.snapshot["detail"] = detail
+            self.publish()
+        elif time.monotonic() - self._last_publish >= self.interval:
+            self.publish()
+
+    def publish(self):
+        """Store the latest snapshot and push it to subscribers."""
+        self._last_publish = time.monotonic()
+        payload = json.dumps(self.snapshot, ensure_ascii=False)
+        key = _progress_key(self.task_id)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(key, payload, ex=SCRAPER_PROGRESS_TTL)
+            pipe.publish(key, payload)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to publish progress of task {self.task_id}: {e}")
+
+
+async def _current_snapshot(redis: AsyncRedis, task_id: str) -> dict:
+    """Return the stored snapshot, falling back to the bare status key."""
+    payload = await redis.get(_progress_key(task_id))
+    if payload:
+        return json.loads(payload)
+    return {"task_id": task_id, "status": await redis.get(task_id) or "None"}
+
+
+def _is_done(snapshot: dict) -> bool:
+    status = snapshot["status"]
+    # Once the snapshot expired, a failed task only has "Failed: ..." in its status key
+    return status in TERMINAL_STATES or status == "None" or status.startswith("Failed")
+
+
+_open_streams = 0
+
+
+def open_streams() -> int:
+    """Number of progress streams this process is serving."""
+    return _open_streams
+
+
+async def stream_progress(
+    redis: AsyncRedis, task_ids: list, subscriber: AsyncRedis = None
+) -> AsyncIterator[str]:
+    """
+    Yield Server-Sent Events for the given tasks until all of them are done. The pubsub
+    connection is taken from `subscriber` when given, since it stays open throughout.
+    """
+    global _open_streams
+    _open_streams += 1
+    pubsub = (subscriber or redis).pubsub()
+    try:
+        # Subscribe before reading snapshots so that no transition is missed
+        await pubsub.subscribe(*[_progress_key(task_id) for task_id in task_ids])
+        pending = set(task_ids)
+        for task_id in task_ids:
+            snapshot = await _current_snapshot(redis, task_id)
+            yield f"event: progress\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            if _is_done(snapshot):
+                pending.discard(task_id)
+
+        while pending:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=SCRAPER_STREAM_KEEPALIVE
+            )
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            snapshot = json.loads(message["data"])
+            if snapshot["task_id"] not in pending:
+                continue
+            yield f"event: progress\ndata: {message['data']}\n\n"
+            if _is_done(snapshot):
+                pending.discard(snapshot["task_id"])
+
+        yield "event: end\ndata: {}\n\n"
+    except asyncio.CancelledError:
+        logger.info(f"Progress stream for {len(task_ids)} tasks closed by client")
+        raise
+    finally:
+        _open_streams -= 1
+        await pubsub.aclose()
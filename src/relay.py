@@ -0,0 +1,243 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+from typing import Awaitable, Callable
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import ResponseError
+from .params import (
+    MESSAGE_STREAM_KEY,
+    MESSAGE_STREAM_MAXLEN,
+    MESSAGE_GROUP,
+    MESSAGE_BATCH_SIZE,
+    MESSAGE_BLOCK_MS,
+    MESSAGE_CONCURRENCY,
+    MESSAGE_HANDLE_TIMEOUT,
+    MESSAGE_CLAIM_IDLE_MS,
+    MESSAGE_CLAIM_INTERVAL,
+    MESSAGE_MAX_DELIVERIES,
+    MESSAGE_DEAD_LETTER_KEY,
+)
+from .utils import get_curr_str_time
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+HANDLE_SECONDS = histogram(
+    "relay_handle_seconds", "Time to handle one relayed message", ("outcome",)
+)
+
+
+async def publish_message(
+    async_redis: AsyncRedis, user_id: str, message: str, **context: str
+) -> str:
+    """Append a message, with optional context such as its resume_id, to the relay stream."""
+    return await async_redis.xadd(
+        MESSAGE_STREAM_KEY,
+        {
+            **context,
+            "user_id": user_id,
+            "message": message,
+            "created_at": get_curr_str_time(),
+        },
+        maxlen=MESSAGE_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+class MessageRelay:
+    """
+    Consume the message stream as one member of a consumer group. Entries are read in
+    batches and handled concurrently, but those of the same user run one after another
+    in arrival order. An entry is acknowledged only once its handler succeeded, so the
+    entries of a crashed consumer stay pending until another consumer claims them, and
+    entries delivered MESSAGE_MAX_DELIVERIES times are moved to a dead-letter stream.
+    Blocking reads go through `reader` when given, keeping them out of the shared pool.
+    """
+
+    def __init__(
+        self,
+        redis: AsyncRedis,
+        handler: Callable[[dict], Awaitable[None]],
+        consumer: str = None,
+        concurrency: int = MESSAGE_CONCURRENCY,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        reader: AsyncRedis = None,
+    ):
+        self.redis = redis
+        self.reader = reader or redis
+        self.handler = handler
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self._slots = asyncio.Semaphore(concurrency)
+        self._lanes = {}
+        self._inflight = set()
+        self.processed = 0
+        self.failed = 0
+        self.dead_lettered = 0
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(
+                MESSAGE_STREAM_KEY, MESSAGE_GROUP, id="0", mkstream=True
+            )
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def run(self):
+        await self.ensure_group()
+        logger.info(f"Message relay consumer {self.consumer} started...")
+        reclaimer = asyncio.create_task(self._reclaim_loop())
+        try:
+            # Entries delivered to this consumer before a restart come first
+            await self._read("0")
+            while True:
+                await self._read(">")
+        finally:
+            reclaimer.cancel()
+
+    async def _read(self, start: str):
+        while True:
+            response = await self.reader.xreadgroup(
+                MESSAGE_GROUP,
+                self.consumer,
+                {MESSAGE_STREAM_KEY: start},
+                count=self.batch_size,
+                block=MESSAGE_BLOCK_MS if start == ">" else None,
+            )
+            entries = response[0][1] if response else []
+            # Re-read pending entries may have failed before
+            deliveries = {} if start == ">" else await self._deliveries(entries)
+            for entry_id, fields in entries:
+                await self._dispatch(entry_id, fields, deliveries.get(entry_id, 1))
+            # New entries are read one batch per call, the backlog until it is drained
+            if start == ">" or not entries:
+                return
+            start = entries[-1][0]
+
+    async def _deliveries(self, entries: list) -> dict:
+        """Return how often each entry has been delivered, from the pending entries list."""
+        if not entries:
+            return {}
+        pipe = self.redis.pipeline(transaction=False)
+        for entry_id, _ in entries:
+            pipe.xpending_range(
+                MESSAGE_STREAM_KEY, MESSAGE_GROUP, min=entry_id, max=entry_id, count=1
+            )
+        return {
+            pending[0]["message_id"]: pending[0]["times_delivered"]
+            for pending in await pipe.execute()
+            if pending
+        }
+
+    async def _dispatch(self, entry_id: str, fields: dict, deliveries: int = 1):
+        if entry_id in self._inflight:
+            return
+        if not fields:
+            # Trimmed from the stream before it was handled
+            await self.redis.xack(MESSAGE_STREAM_KEY, MESSAGE_GROUP, entry_id)
+            return
+        if deliveries > MESSAGE_MAX_DELIVERIES:
+            await self._dead_letter(entry_id, fields, deliveries)
+            return
+
+        await self._slots.acquire()
+        user_id = fields.get("user_id")
+        previous = self._lanes.get(user_id)
+        task = asyncio.create_task(self._process(entry_id, fields, previous))
+        self._lanes[user_id] = task
+        self._inflight.add(entry_id)
+        task.add_done_callback(lambda t: self._finish(user_id, entry_id, t))
+
+    async def _process(self, entry_id: str, fields: dict, previous: asyncio.Task):
+        started = time.perf_counter()
+        try:
+            if previous is not None:
+                await asyncio.wait({previous})
+                started = time.perf_counter()
+            await asyncio.wait_for(self.handler(fields), MESSAGE_HANDLE_TIMEOUT)
+            await self.redis.xack(MESSAGE_STREAM_KEY, MESSAGE_GROUP, entry_id)
+            HANDLE_SECONDS.observe(time.perf_counter() - started, "ok")
+            self.processed += 1
+        except Exception as e:
+            # Left pending, so it is retried once claimed again
+            HANDLE_SECONDS.observe(time.perf_counter() - started, "error")
+            self.failed += 1
+            logger.error(f"Failed to process message {entry_id}: {e}")
+        finally:
+            self._slots.release()
+
+    def _finish(self, user_id: str, entry_id: str, task: asyncio.Task):
+        self._inflight.discard(entry_id)
+        if self._lanes.get(user_id) is task:
+            del self._lanes[user_id]
+
+    async def _dead_letter(self, entry_id: str, fields: dict, deliveries: int):
+        pipe = self.redis.pipeline()
+        pipe.xadd(
+            MESSAGE_DEAD_LETTER_KEY,
+            {**fields, "entry_id": entry_id, "deliveries": deliveries},
+            maxlen=MESSAGE_STREAM_MAXLEN,
+            approximate=True,
+        )
+        pipe.xack(MESSAGE_STREAM_KEY, MESSAGE_GROUP, entry_id)
+        await pipe.execute()
+        self.dead_lettered += 1
+        logger.error(
+            f"Message {entry_id} failed {deliveries - 1} times, moved to {MESSAGE_DEAD_LETTER_KEY}"
+        )
+
+    async def _touch_inflight(self):
+        """Reset the idle time of the entries still being handled, so none is claimed."""
+        if self._inflight:
+            await self.redis.xclaim(
+                MESSAGE_STREAM_KEY,
+                MESSAGE_GROUP,
+                self.consumer,
+                0,
+                list(self._inflight),
+                justid=True,
+            )
+
+    async def _reclaim_loop(self):
+        while True:
+            await asyncio.sleep(MESSAGE_CLAIM_INTERVAL)
+            try:
+                await self._touch_inflight()
+                await self.reclaim()
+            except Exception as e:
+                logger.error(f"Failed to reclaim pending messages: {e}")
+
+    async def reclaim(self) -> int:
+        """Take over the entries other consumers left unacknowledged for too long."""
+        start, claimed = "0-0", 0
+        while True:
+            start, entries, *_ = await self.redis.xautoclaim(
+                MESSAGE_STREAM_KEY,
+                MESSAGE_GROUP,
+                self.consumer,
+                MESSAGE_CLAIM_IDLE_MS,
+                start_id=start,
+                count=self.batch_size,
+            )
+            deliveries = await self._deliveries(entries)
+            for entry_id, fields in entries:
+                await self._dispatch(entry_id, fields, deliveries.get(entry_id, 1))
+            claimed += len(entries)
+            if start == "0-0":
+                break
+        if claimed:
+            logger.info(f"Reclaimed {claimed} pending messages")
+        return claimed
+
+    def stats(self) -> dict:
+        return {
+            "consumer": self.consumer,
+            "inflight": len(self._inflight),
+            "lanes": len(self._lanes),
+            "processed": self.processed,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+        }
@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import logging
+import functools
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from .params import TABLE, RESPONDER_MAX_WORKERS, RESPONDER_MAX_PENDING
+from .database import AsyncMongoDBDatabase
+from .chat import load_chat, append_messages, new_message
+from .models import get_chat_functions
+
+logger = logging.getLogger(__name__)
+
+
+def _generate(message: str, chat: dict, job: dict) -> str:
+    return get_chat_functions()[0](message, chat, job)
+
+
+def _invite(resume: dict, job: dict) -> str:
+    return get_chat_functions()[1](resume, job)
+
+
+class ResponseService:
+    """
+    Generate chat replies and invitations in process. The blocking model calls run on
+    a bounded thread pool, at most RESPONDER_MAX_PENDING of them queued or running, and
+    identical requests that are already in flight share one model call.
+    """
+
+    def __init__(
+        self,
+        async_db: AsyncMongoDBDatabase,
+        generate: Callable = _generate,
+        invite: Callable = _invite,
+        max_workers: int = RESPONDER_MAX_WORKERS,
+        max_pending: int = RESPONDER_MAX_PENDING,
+    ):
+        self.async_db = async_db
+        self.generate = generate
+        self.invite_fn = invite
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="responder")
+        self._pending = asyncio.Semaphore(max_pending)
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def _call(self, fn: Callable, *args):
+        async with self._pending:
+            self.calls += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(fn, *args)
+            )
+
+    async def _single_flight(self, key: str, factory):
+        """Run `factory()` once per key at a time, later callers await the same result."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(factory())
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def _load_job(self, job_id: str):
+        if not job_id:
+            return None
+        jobs = await self.async_db.select_data(
+            TABLE.JOB.value, {"_id": ObjectId(job_id)}
+        )
+        return jobs[0] if jobs else None
+
+    async def respond(self, message: str, resume_id: str, job_id: str = None) -> str:
+        """Reply to a candidate's message and record the turn in their chat history."""
+        key = hashlib.sha1(
+            f"{resume_id}|{job_id}|{message}".encode("utf-8")
+        ).hexdigest()
+
+        async def generate():
+            chat, job = await asyncio.gather(
+                load_chat(self.async_db, resume_id), self._load_job(job_id)
+            )
+            return await self._call(self.generate, message, chat, job)
+
+        # Only the model call is shared, every caller's turn is recorded
+        response = await self._single_flight(f"respond:{key}", generate)
+        await append_messages(
+            self.async_db,
+            resume_id,
+            [new_message("user", message), new_message("system", response)],
+        )
+        return response
+
+    async def invite(self, resume_id: str, job_id: str) -> str:
+        """Compose the invitation of a candidate to a job."""
+
+        async def invite():
+            resumes, job = await asyncio.gather(
+                self.async_db.select_data(TABLE.RESUME.value, {"resume_id": resume_id}),
+                self._load_job(job_id),
+            )
+            return await self._call(self.invite_fn, resumes[0], job)
+
+        return await self._single_flight(f"invite:{resume_id}|{job_id}", invite)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,154 @@
+import time
+import logging
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from rq import Queue
+from rq.job import Job
+from rq.registry import StartedJobRegistry
+from .params import (
+    MAX_RUNNING_TASKS,
+    SCRAPER_EVENTS_CHANNEL,
+    SCRAPER_FILTER_KEY,
+    SCRAPER_INFLIGHT_TTL,
+    SCRAPER_RESULT_TTL,
+    SCRAPER_PENDING_TASKS_KEY,
+    SCRAPER_PENDING_SINCE_KEY,
+    SCRAPER_PROCESSING_TASKS_KEY,
+    SCRAPER_RUNNING_TASKS_KEY,
+)
+
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+PENDING_SECONDS = histogram(
+    "scraper_pending_seconds", "Time scraper tasks wait before they are dispatched"
+)
+
+# Move the next pending task into the processing list only if a slot is free
+CLAIM_SLOT_SCRIPT = """
+local running = tonumber(redis.call('GET', KEYS[1]) or '0')
+if running >= tonumber(ARGV[1]) then
+    return false
+end
+local task_id = redis.call('LMOVE', KEYS[2], KEYS[3], 'LEFT', 'RIGHT')
+if task_id then
+    redis.call('INCR', KEYS[1])
+end
+return task_id
+"""
+
+# Keep a finished task's filter reservation for reuse, drop it after a failure
+SETTLE_FILTER_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '1' then
+    return redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+# Free a slot only while the task still holds it, so releasing twice is harmless
+RELEASE_SLOT_SCRIPT = """
+if redis.call('LREM', KEYS[2], 0, ARGV[1]) == 0 then
+    return 0
+end
+redis.call('DECR', KEYS[1])
+redis.call('PUBLISH', KEYS[3], 'released:' .. ARGV[1])
+return 1
+"""
+
+# Task states that another submission with the same filters can attach to
+REUSABLE_STATES = {"Pending", "Scraping", "Committing", "Finished"}
+
+_SLOT_KEYS = [
+    SCRAPER_RUNNING_TASKS_KEY,
+    SCRAPER_PENDING_TASKS_KEY,
+    SCRAPER_PROCESSING_TASKS_KEY,
+]
+
+
+async def claim_pending_tasks(redis: AsyncRedis) -> list:
+    """Atomically claim pending tasks until no slot or no task is left."""
+    claim_slot = redis.register_script(CLAIM_SLOT_SCRIPT)
+    claimed = []
+    while task_id := await claim_slot(keys=_SLOT_KEYS, args=[MAX_RUNNING_TASKS]):
+        claimed.append(task_id)
+
+    if claimed:
+        pipe = redis.pipeline(transaction=False)
+        pipe.hmget(SCRAPER_PENDING_SINCE_KEY, claimed)
+        pipe.hdel(SCRAPER_PENDING_SINCE_KEY, *claimed)
+        submitted, _ = await pipe.execute()
+        now = time.time()
+        for since in submitted:
+            if since is not None:
+                PENDING_SECONDS.observe(now - float(since))
+    return claimed
+
+
+async def enqueue_pending(redis: AsyncRedis, task_id: str):
+    """Queue a submitted task and wake the scheduler up."""
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(SCRAPER_PENDING_SINCE_KEY, task_id, time.time())
+    pipe.rpush(SCRAPER_PENDING_TASKS_KEY, task_id)
+    pipe.publish(SCRAPER_EVENTS_CHANNEL, f"submitted:{task_id}")
+    await pipe.execute()
+
+
+def release_slot(redis: Redis, task_id: str) -> bool:
+    """Free the slot held by a task and wake the scheduler up, False if it held none."""
+    return bool(
+        redis.eval(
+            RELEASE_SLOT_SCRIPT,
+            3,
+            SCRAPER_RUNNING_TASKS_KEY,
+            SCRAPER_PROCESSING_TASKS_KEY,
+            SCRAPER_EVENTS_CHANNEL,
+            task_id,
+        )
+    )
+
+
+def release_failed_task(job: Job, connection: Redis, exc_type, exc_value, traceback):
+    """
+    RQ failure callback of scraper jobs. It also runs for the jobs of workers that died
+    mid-task, whose own cleanup never ran, once reap_abandoned_tasks finds them.
+    """
+    task_id = job.args[0]
+    if release_slot(connection, task_id):
+        connection.set(task_id, f"Failed: {exc_type.__name__}")
+        logger.error(f"Released the slot of failed task {task_id}: {exc_value!r}")
+
+
+def reap_abandoned_tasks(queue: Queue):
+    """Fail the jobs of dead scraper workers, which runs their failure callback."""
+    StartedJobRegistry(queue=queue).cleanup()
+
+
+async def reserve_filter(redis: AsyncRedis, filter_hash: str, task_id: str) -> str:
+    """Reserve the filters for a new task, or return the live task that holds them."""
+    key = f"{SCRAPER_FILTER_KEY}:{filter_hash}"
+    if await redis.set(key, task_id, nx=True, ex=SCRAPER_INFLIGHT_TTL):
+        return task_id
+
+    holder = await redis.get(key)
+    if holder and await redis.get(holder) in REUSABLE_STATES:
+        return holder
+
+    # The previous holder failed or expired, take the reservation over
+    await redis.set(key, task_id, ex=SCRAPER_INFLIGHT_TTL)
+    return task_id
+
+
+def settle_filter(redis: Redis, filter_hash: str, task_id: str, finished: bool):
+    """Keep a finished task reusable for SCRAPER_RESULT_TTL, or release a failed one."""
+    redis.eval(
+        SETTLE_FILTER_SCRIPT,
+        1,
+        f"{SCRAPER_FILTER_KEY}:{filter_hash}",
+        task_id,
+        int(finished),
+        SCRAPER_RESULT_TTL,
+    )
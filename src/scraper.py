@@ -1,97 +1,148 @@
 import json
+import time
+import codecs
 import shlex
 import subprocess
+from typing import Iterator
 from bson import ObjectId
-from redis import Redis
 from .params import (
-    REDIS_HOST,
-    REDIS_POST,
     TABLE,
     SCRAPER_DIR,
+    SCRAPER_ENTRY,
     SCRAPER_LOG_DIR,
-    SCRAPER_RUNNING_TASKS_KEY,
+    SCRAPER_READ_CHUNK_SIZE,
 )
-from .utils import get_curr_str_time
-from .database import MongoDBDatabase
+from .utils import get_curr_str_time, JSONStreamDecoder
+from .database import MongoDBDatabase, BulkUpserter
+from .scheduler import release_slot, settle_filter
+from .pool import InProcessScraper, is_warm
+from .progress import ProgressReporter
+from .index import TermsWriter
+from .dashboard import touch_dashboard
+from .cache import DocumentCache
+from .connection import get_redis
+from .metrics import counter, histogram, flush_quietly
+
+nsync_redis = get_redis()
+
+# Shared by the tasks run in this worker, publishes invalidations to the app
+doc_cache = DocumentCache(nsync_redis, subscriber=get_redis(subscriber=True))
+
+# Scraping and Committing are timed, the other states end a task
+PHASES = ("Scraping", "Committing")
+PHASE_SECONDS = histogram(
+    "scraper_phase_seconds", "Time scraper tasks spend in each phase", ("phase",)
+)
+TASKS = counter("scraper_tasks_total", "Scraper tasks by final status", ("status",))
+RECORDS = counter("scraper_records_total", "Records parsed from scraper output")
+
+
+def _stream_records(stream, log) -> Iterator[dict]:
+    """Tee the raw scraper output to the log and yield records as soon as they are complete."""
+    decoder = JSONStreamDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
 
-nsync_redis = Redis(host=REDIS_HOST, port=REDIS_POST, db=0, decode_responses=True)
+    while chunk := stream.read1(SCRAPER_READ_CHUNK_SIZE):
+        log.write(chunk)
+        yield from decoder.feed(text_decoder.decode(chunk))
+
+    yield from decoder.feed(text_decoder.decode(b"", final=True))
+    if decoder.pending:
+        raise json.JSONDecodeError("Truncated record at end of output", "", 0)
 
 
 def run_scraper(task_id: str):
-    """Run the scraper subprocess."""
+    """Run the scraper subprocess and commit its records while it is still crawling."""
+    TASK_QUERY = {"task_id": task_id}
+    mongo_db = MongoDBDatabase(cache=doc_cache)
+    mongo_db.create_connection()
+    progress = ProgressReporter(nsync_redis, task_id)
+    phase, phase_started = None, time.perf_counter()
+
+    def set_status(status: str, detail: str = None):
+        nonlocal phase, phase_started
+        now = time.perf_counter()
+        if phase is not None:
+            PHASE_SECONDS.observe(now - phase_started, phase)
+        if status in PHASES:
+            phase, phase_started = status, now
+        else:
+            phase = None
+            TASKS.inc(status)
+        nsync_redis.set(task_id, detail or status)
+        mongo_db.update_data(TABLE.TASK.value, TASK_QUERY, {"status": status})
+        touch_dashboard(nsync_redis, TABLE.TASK.value)
+        progress.update(status, detail)
+
+    filter_hash = None
+    finished = False
     try:
-        TASK_QUERY = {"task_id": task_id}
-        mongo_db = MongoDBDatabase()
-        mongo_db.create_connection()
-
-        nsync_redis.set(task_id, "Scraping")
-        mongo_db.update_data(TABLE.TASK.value, TASK_QUERY, {"status": "Scraping"})
+        set_status("Scraping")
         param_input = mongo_db.select_data(TABLE.TASK.value, TASK_QUERY)[0]
+        filter_hash = param_input.pop("filter_hash", None)
         param_input = {
             k: v for k, v in param_input.items() if not isinstance(v, ObjectId)
         }
 
         param_input = json.dumps(param_input)
 
-        # Stream the output to log
+        # Stream the output to log and database at the same time
         log_file = f"{SCRAPER_LOG_DIR}/{task_id}.log"
-        process = subprocess.run(
-            f"python main.py {shlex.quote(param_input)}",
-            shell=True,
-            capture_output=True,
-            text=True,
-            cwd=SCRAPER_DIR,
-        )
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(
-                process.returncode,
-                process.args,
-                output=process.stdout,
-                stderr=process.stderr,
-            )
-
-        with open(log_file, "w") as log:
-            log.write(process.stdout)
-
-        # Write output to database
-        nsync_redis.set(task_id, "Committing")
-        mongo_db.update_data(TABLE.TASK.value, TASK_QUERY, {"status": "Committing"})
-
-        with open(log_file, "r") as log:
+        err_file = f"{SCRAPER_LOG_DIR}/{task_id}.err.log"
+        with open(log_file, "wb") as log, open(err_file, "wb") as err:
+            if is_warm():
+                process = InProcessScraper(param_input, stderr=err)
+            else:
+                process = subprocess.Popen(
+                    ["python", SCRAPER_ENTRY, param_input],
+                    stdout=subprocess.PIPE,
+                    stderr=err,
+                    cwd=SCRAPER_DIR,
+                )
             try:
-                buffer = ""
-                # Iterate through resume list
-                for line in log:
-                    buffer += line.strip()
-
-                    try:
-                        record = json.loads(buffer)
+                committing = False
+                with BulkUpserter(
+                    mongo_db, TABLE.RESUME.value, hash_field="content_hash"
+                ) as writer, TermsWriter(mongo_db) as terms_writer:
+                    for parsed, record in enumerate(
+                        _stream_records(process.stdout, log), 1
+                    ):
+                        if not committing:
+                            set_status("Committing")
+                            committing = True
                         record["created_at"] = get_curr_str_time()
-                        mongo_db.insert_data("resume", record)
-                        buffer = ""
-                    except json.JSONDecodeError:
-                        continue
-
-            except Exception as e:
-                nsync_redis.set(task_id, f"Failed: {str(e)}")
-                mongo_db.update_data(
-                    TABLE.TASK.value, TASK_QUERY, {"status": "FormatError"}
-                )
-
-        nsync_redis.set(task_id, "Finished")
-        mongo_db.update_data(TABLE.TASK.value, TASK_QUERY, {"status": "Finished"})
+                        writer.add(record)
+                        terms_writer.add(record)
+                        RECORDS.inc()
+                        progress.update(parsed=parsed, bytes=log.tell(), **writer.stats)
+                progress.update(bytes=log.tell(), **writer.stats)
+                if committing:
+                    touch_dashboard(nsync_redis, TABLE.RESUME.value)
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, process.args)
+
+        set_status("Finished")
+        finished = True
+
+    except json.JSONDecodeError as e:
+        set_status("FormatError", f"Failed: {str(e)}")
 
     except subprocess.CalledProcessError as e:
-        nsync_redis.set(task_id, f"Failed: {str(e)}")
-        mongo_db.update_data(TABLE.TASK.value, TASK_QUERY, {"status": "ProcessError"})
+        set_status("ProcessError", f"Failed: {str(e)}")
 
     except Exception as e:
-        nsync_redis.set(task_id, f"Failed: {str(e)}")
-        mongo_db.update_data(TABLE.TASK.value, TASK_QUERY, {"status": "UnknownError"})
+        set_status("UnknownError", f"Failed: {str(e)}")
 
     finally:
-        nsync_redis.decr(SCRAPER_RUNNING_TASKS_KEY)
+        if filter_hash:
+            settle_filter(nsync_redis, filter_hash, task_id, finished)
+        release_slot(nsync_redis, task_id)
         mongo_db.close_connection()
+        flush_quietly(nsync_redis)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,102 @@
+import re
+import json
+import hashlib
 from datetime import datetime
 
+# Bookkeeping fields that never contribute to a document's content hash
+HASH_EXCLUDED_FIELDS = frozenset({"_id", "created_at", "updated_at", "content_hash"})
+
+# Task fields that are not part of the scraper filters
+TASK_META_FIELDS = frozenset({"_id", "task_id", "status", "created_at", "filter_hash"})
+
 
 def get_curr_str_time():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_content_hash(data: dict, exclude=HASH_EXCLUDED_FIELDS) -> str:
+    """Return a stable hash of a document's content, ignoring bookkeeping fields."""
+    content = {k: v for k, v in data.items() if k not in exclude}
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+def _canonicalize(value):
+    """Sort dict keys and list values recursively so equal filters compare equal."""
+    if isinstance(value, dict):
+        return {k: _canonicalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, list):
+        items = [_canonicalize(v) for v in value]
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True, default=str))
+    return value
+
+
+def get_filter_hash(params: dict) -> str:
+    """Return the hash of a scraper task's canonicalised filters."""
+    filters = {k: v for k, v in params.items() if k not in TASK_META_FIELDS}
+    return get_content_hash(_canonicalize(filters), exclude=())
+
+
+class JSONStreamDecoder:
+    """
+    Incrementally decode JSON objects from a text stream fed chunk by chunk.
+
+    Only the newly appended text is scanned on each `feed`, so multi-line records are
+    parsed in linear time. Text outside of a top-level object is ignored.
+    """
+
+    _TOKEN = re.compile(r'[{}"\\]')
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+
+    @property
+    def pending(self) -> bool:
+        """Whether a partially received object is still buffered."""
+        return self._depth > 0
+
+    def feed(self, text: str) -> list:
+        """Append text and return the objects completed by it."""
+        records = []
+        buffer = self._buffer + text
+        pos = self._pos
+
+        while True:
+            match = self._TOKEN.search(buffer, pos)
+            if match is None:
+                pos = max(pos, len(buffer))
+                break
+            idx = match.start()
+            char = buffer[idx]
+            pos = idx + 1
+
+            if self._depth == 0:
+                if char == "{":
+                    self._start = idx
+                    self._depth = 1
+            elif self._in_string:
+                if char == "\\":
+                    pos = idx + 2
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    records.append(json.loads(buffer[self._start : pos]))
+
+        # Keep only the unfinished object in the buffer
+        if self._depth == 0:
+            self._buffer, self._pos, self._start = "", 0, 0
+        else:
+            self._buffer = buffer[self._start :]
+            self._pos = pos - self._start
+            self._start = 0
+        return records